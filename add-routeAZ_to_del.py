@@ -5,20 +5,32 @@ import hashlib
 import base64
 import time
 import uuid
-import json
 import os
+import functools
+import datetime
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_shared
+from pritunl_server import FAILED, SKIPPED, UNCHANGED, print_rollout_summary, start_result, start_server, stop_server
+from pritunl_coord import ServerRetired, atomic_write, file_lock, mutation_window
+from ip_ranges import load_sources
 
 SETTINGS_FILE = 'pritunl_settings.yml'
 AZURE_JSON_FILE = 'ServiceTags_Public_20250203.json' 
+DEFAULT_IP_SOURCES = [{'provider': 'azure', 'file': AZURE_JSON_FILE, 'filters': ['tag=AzureDevOps', 'tag=AzureCloud.westeurope']}]
 ROUTES_DELETE_FILE = 'routes_to_delete.txt'  
+LEDGER_DIR = 'routes_ledger'
+JOB_NAME = 'add-routeAZ_to_del'
 CERT_PATH = ('/etc/ssl/my.crt', '/etc/ssl/my.key')  
 
 
+@traced()
 def load_settings(filename=SETTINGS_FILE):
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -32,15 +44,16 @@ def create_signature(api_token, api_secret, method, path):
     }
 
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
-            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True, timeout=30)
         else:
-            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True, timeout=30)
 
         if response.status_code in [200, 201, 204]:
-            return response.json() if response.text else None
+            return response.json() if response.text else {}
         else:
             print(f'API Error {response.status_code}: {response.text}')
             return None
@@ -58,113 +71,160 @@ def load_routes_to_delete():
 
 
 def save_routes_to_delete(routes):
-    if not routes:
-        print("No routes to save in routes_to_delete.txt.")
-        return
-
-    with open(ROUTES_DELETE_FILE, 'w') as file:
-        for route in sorted(routes):
-            file.write(route + '\n')
+    """ Перезаписывает файл всегда: пустой набор очищает его, чтобы delete_route.py не удалил старые маршруты. """
+    atomic_write(ROUTES_DELETE_FILE, lambda file: file.writelines(route + '\n' for route in sorted(routes)))
 
     print(f" Saved {len(routes)} routes to {ROUTES_DELETE_FILE}")
 
 
-def get_existing_routes(base_url, api_token, api_secret, server_id):
-    url = f"{base_url}/server/{server_id}/route"
-    headers = create_signature(api_token, api_secret, 'GET', f"/server/{server_id}/route")
+def ledger_path(server_id):
+    return os.path.join(LEDGER_DIR, f'server_{server_id}_ledger.yml')
 
-    routes = send_request(url, 'GET', headers)
-    if routes:
-        return {route["network"] for route in routes}  
-    return set()
+
+def load_ledger(server_id):
+    """ Загружает журнал управляемых маршрутов сервера: {network: {source, first_seen, last_seen}}. """
+    filename = ledger_path(server_id)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, 'r') as file:
+        data = yaml.safe_load(file) or {}
+    return data.get('routes', {})
 
 
-def add_route_to_server(base_url, api_token, api_secret, server_id, route):
+def save_ledger(server_id, ledger):
+    atomic_write(ledger_path(server_id), lambda file: yaml.dump(
+        {'server_id': server_id, 'routes': ledger}, file, default_flow_style=False, allow_unicode=True))
+
+    print(f" Ledger for {server_id}: {len(ledger)} managed routes")
+
+
+@traced(args=('server_id',))
+def get_existing_routes(base_url, api_token, api_secret, server_id):
+    """ Возвращает маршруты сервера в виде {network: route_id} или None, если список получить не удалось. """
     url = f"{base_url}/server/{server_id}/route"
-    headers = create_signature(api_token, api_secret, 'POST', f"/server/{server_id}/route")
-    data = {"network": route}
-
-    response = send_request(url, 'POST', headers, data)
-    if response:
-        print(f" Added route {route} to server {server_id}")
-        return True
-    else:
-        print(f" Failed to add route {route} to server {server_id}")
-        return False
-
-def get_azure_ips():
-    if not os.path.exists(AZURE_JSON_FILE):
-        print(f" JSON file {AZURE_JSON_FILE} not found!")
-        return set()
+    headers = create_signature(api_token, api_secret, 'GET', f"/server/{server_id}/route")
 
+    routes = fetch_routes_shared(server_id, url, headers, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return None
     try:
-        with open(AZURE_JSON_FILE, 'r') as file:
-            data = json.load(file)
-            azure_ips = set()
-
-      
-            if "values" in data:
-                for entry in data["values"]:
-                    if entry.get("name") in ["AzureDevOps", "AzureCloud.westeurope"] or \
-                       entry.get("id") in ["AzureDevOps", "AzureCloud.westeurope"] or \
-                       entry.get("systemService") in ["AzureDevOps", "AzureCloud.westeurope"]:
-                        if "properties" in entry and "addressPrefixes" in entry["properties"]:
-                            for ip in entry["properties"]["addressPrefixes"]:
-                                azure_ips.add(ip)
-
-            print(f" Found {len(azure_ips)} Azure IPs from JSON file")
-            return azure_ips
-    except json.JSONDecodeError as e:
-        print(f" JSON parsing error: {e}")
-        return set()
-    except Exception as e:
-        print(f" Failed to read JSON: {e}")
-        return set()
+        return {route["network"]: route["id"] for route in routes}
+    except RouteStreamError as e:
+        print(e)
+        return None
 
 
-def add_azure_routes_to_server(base_url, api_token, api_secret, server_id):
-    azure_ips = get_azure_ips()
-    if not azure_ips:
-        print("No Azure IP found.")
-        return
+def signed_request(base_url, api_token, api_secret, method, path, data=None):
+    headers = create_signature(api_token, api_secret, method, path)
+    return send_request(f'{base_url}{path}', method, headers, data)
+
 
-    routes_to_delete = load_routes_to_delete()
+@traced()
+def get_source_ips(settings):
+    """ Собирает префиксы из ip_sources в настройках (по умолчанию - теги Azure из AZURE_JSON_FILE). """
+    return load_sources(settings.get('ip_sources') or DEFAULT_IP_SOURCES)
 
-   
+
+@traced(args=('server_id',))
+def plan_azure_routes(base_url, api_token, api_secret, server_id, azure_ips, legacy_routes):
+    """
+    Пре-стейдж: сравнивает источник с сервером и журналом, пока сервер работает.
+    Удаляются только маршруты из журнала, которых больше нет в источнике; маршруты,
+    добавленные вручную, в журнал не попадают и не трогаются.
+    Возвращает None, если список маршрутов сервера получить не удалось.
+    """
     existing_routes = get_existing_routes(base_url, api_token, api_secret, server_id)
+    if existing_routes is None:
+        return None
 
-    added_routes = set()
-    for route in azure_ips:
-        if route in existing_routes or route in routes_to_delete:
-            print(f" Route {route} already exists or skipping.")
-        else:
-            if add_route_to_server(base_url, api_token, api_secret, server_id, route):
-                added_routes.add(route)
+    ledger = load_ledger(server_id)
+    if ledger is None:
+        # Первый запуск: маршруты из routes_to_delete.txt считаются добавленными ранее из Azure
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        ledger = {
+            route: {'source': {'file': ROUTES_DELETE_FILE}, 'first_seen': now, 'last_seen': now}
+            for route in legacy_routes if route in existing_routes
+        }
+        print(f" No ledger for {server_id}, adopted {len(ledger)} routes from {ROUTES_DELETE_FILE}")
+
+    routes_to_add = sorted(route for route in azure_ips if route not in existing_routes)
+    routes_to_expire = {
+        route: existing_routes[route]
+        for route in sorted(ledger)
+        if route not in azure_ips and route in existing_routes
+    }
+    print(f" Server {server_id}: {len(routes_to_add)} to add, {len(routes_to_expire)} expired")
 
-    return added_routes
+    return ledger, existing_routes, routes_to_add, routes_to_expire
 
 
-def manage_server(base_url, api_token, api_secret, server_id, server_name):
-    print(f"\n Managing server: {server_name} ({server_id})")
+def update_ledger(ledger, azure_ips, existing_routes, added_routes, deleted_routes):
+    """ Обновляет журнал после изменений: новые маршруты, last_seen, удаленные и исчезнувшие. """
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
 
+    for route in list(ledger):
+        if route in deleted_routes or (route not in existing_routes and route not in added_routes):
+            del ledger[route]
 
-    stop_url = f'{base_url}/server/{server_id}/operation/stop'
-    stop_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/stop')
-    stop_response = send_request(stop_url, 'PUT', stop_headers)
-    print(f'Server stop response: {stop_response}')
+    for route, source in azure_ips.items():
+        if route in added_routes:
+            ledger[route] = {'source': dict(source), 'first_seen': now, 'last_seen': now}
+        elif route in ledger:
+            ledger[route]['source'] = dict(source)
+            ledger[route]['last_seen'] = now
 
- 
-    added_routes = add_azure_routes_to_server(base_url, api_token, api_secret, server_id)
+    return ledger
 
-   
-    if added_routes:
-        save_routes_to_delete(added_routes)
 
+@traced(args=('server_id',))
+def manage_server(base_url, api_token, api_secret, server_id, server_name, azure_ips, legacy_routes):
+    """
+    Возвращает (статус, значение) из pritunl_server: READY и время готовности сервера,
+    UNCHANGED, SKIPPED и причину пропуска или FAILED, если сервер не запустился.
+    """
+    print(f"\n Managing server: {server_name} ({server_id})")
 
-    start_url = f'{base_url}/server/{server_id}/operation/start'
-    start_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/start')
-    start_response = send_request(start_url, 'PUT', start_headers)
-    print(f'Server start response: {start_response}')
+    # Журнал сервера меняют задания этого скрипта по очереди
+    with file_lock(f'ledger_{server_id}'):
+        # Все чтение и сравнение выполняется до остановки сервера
+        plan = plan_azure_routes(base_url, api_token, api_secret, server_id, azure_ips, legacy_routes)
+        if plan is None:
+            # Пустой список вместо ошибки привел бы к повторному добавлению всех маршрутов
+            print(f" Could not fetch routes for {server_id}, server and ledger left untouched.")
+            return SKIPPED, 'route listing failed'
+        ledger, existing_routes, routes_to_add, routes_to_expire = plan
+        if not routes_to_add and not routes_to_expire:
+            print(f" No route changes for server {server_id}, server left running.")
+            save_ledger(server_id, update_ledger(ledger, azure_ips, existing_routes, set(), set()))
+            return UNCHANGED, None
+
+        mutation = {'job': JOB_NAME, 'add': routes_to_add, 'delete': routes_to_expire}
+        try:
+            with mutation_window(server_id, mutation) as window:
+                if window is None:
+                    # Изменения применило другое задание: добавленные считаем своими, устаревшие
+                    # оставляем в журнале до следующего запуска, который их проверит
+                    save_ledger(server_id, update_ledger(ledger, azure_ips, existing_routes, set(routes_to_add), set()))
+                    return SKIPPED, 'changes applied by another job'
+
+                critical_started = time.monotonic()
+                request = functools.partial(signed_request, base_url, api_token, api_secret)
+                stop_server(request, server_id)
+
+                added_routes, deleted_routes = window.apply(request)
+                added_routes = added_routes & set(routes_to_add)
+                deleted_routes = deleted_routes & set(routes_to_expire)
+                time_to_ready = start_server(request, server_id)
+                print(f' Critical section for {server_id} lasted {time.monotonic() - critical_started:.1f}s '
+                      f'({len(added_routes)} of {len(routes_to_add)} added, '
+                      f'{len(deleted_routes)} of {len(routes_to_expire)} expired deleted)')
+        except ServerRetired as e:
+            print(f" {e}")
+            return SKIPPED, 'server replaced by blue/green rollout'
+
+        save_ledger(server_id, update_ledger(ledger, azure_ips, existing_routes, added_routes, deleted_routes))
+    return start_result(time_to_ready)
 
 def main():
     settings = load_settings()
@@ -178,10 +238,33 @@ def main():
         return
 
 
+    azure_ips = get_source_ips(settings)
+    if azure_ips is None:
+        print("Some ip_sources could not be loaded, nothing changed.")
+        return
+    if not azure_ips:
+        print("No IPs found in ip_sources.")
+        return
+    legacy_routes = load_routes_to_delete()
+
+    results = {}
     for server in servers:
         server_id = server.get("id")
         server_name = server.get("name", "Unknown Server")
-        manage_server(base_url, api_token, api_secret, server_id, server_name)
+        results[server_id] = manage_server(base_url, api_token, api_secret, server_id, server_name,
+                                           azure_ips, legacy_routes)
+        if results[server_id][0] == FAILED:
+            print(f"Server {server_id} did not come back online, stopping rollout.")
+            break
+
+    # routes_to_delete.txt - список всех маршрутов Azure, которыми управляет скрипт (для delete_route.py)
+    managed_routes = set()
+    for server in servers:
+        managed_routes.update(load_ledger(server.get("id")) or {})
+    save_routes_to_delete(managed_routes)
+
+    print_rollout_summary(results)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
@@ -5,19 +5,28 @@ import hashlib
 import base64
 import time
 import uuid
-import json
-import os
+import functools
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_shared
+from pritunl_server import FAILED, SKIPPED, UNCHANGED, print_rollout_summary, start_result, start_server, stop_server
+from pritunl_coord import ServerRetired, mutation_window
+from ip_ranges import load_sources
 
 SETTINGS_FILE = 'pritunl_settings.yml'
 AZURE_JSON_FILE = 'ServiceTags_Public_20250203.json'  
+JOB_NAME = 'add_route_azure'
+DEFAULT_IP_SOURCES = [{'provider': 'azure', 'file': AZURE_JSON_FILE, 'filters': ['tag=AzureDevOps']}]
 CERT_PATH = ('/etc/ssl/my.crt', '/etc/my.key')  
 
 # Загрузка настроек из YAML файла
+@traced()
 def load_settings(filename=SETTINGS_FILE):
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -31,15 +40,16 @@ def create_signature(api_token, api_secret, method, path):
     }
 
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
-            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True, timeout=30)
         else:
-            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True, timeout=30)
 
         if response.status_code in [200, 201, 204]:
-            return response.json() if response.text else None
+            return response.json() if response.text else {}
         else:
             print(f'API Error {response.status_code}: {response.text}')
             return None
@@ -48,89 +58,81 @@ def send_request(url, method, headers, data=None):
         return None
 
 
+@traced(args=('server_id',))
 def get_existing_routes(base_url, api_token, api_secret, server_id):
+    """ Возвращает сети маршрутов сервера или None, если список получить не удалось. """
     url = f"{base_url}/server/{server_id}/route"
     headers = create_signature(api_token, api_secret, 'GET', f"/server/{server_id}/route")
 
-    routes = send_request(url, 'GET', headers)
-    if routes:
-        return {route["network"] for route in routes}  
-    return set()
+    routes = fetch_routes_shared(server_id, url, headers, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return None
+    try:
+        return {route["network"] for route in routes}
+    except RouteStreamError as e:
+        print(e)
+        return None
 
 
-def add_route_to_server(base_url, api_token, api_secret, server_id, route):
-    url = f"{base_url}/server/{server_id}/route"
-    headers = create_signature(api_token, api_secret, 'POST', f"/server/{server_id}/route")
-    data = {"network": route}
+def signed_request(base_url, api_token, api_secret, method, path, data=None):
+    headers = create_signature(api_token, api_secret, method, path)
+    return send_request(f'{base_url}{path}', method, headers, data)
 
-    response = send_request(url, 'POST', headers, data)
-    if response:
-        print(f"Added route {route} to server {server_id}")
-    else:
-        print(f"Failed to add route {route} to server {server_id}")
 
+@traced()
+def get_source_ips(settings):
+    """ Собирает префиксы из ip_sources в настройках (по умолчанию - теги Azure из AZURE_JSON_FILE). """
+    return load_sources(settings.get('ip_sources') or DEFAULT_IP_SOURCES)
 
-def get_azure_devops_ips():
-    if not os.path.exists(AZURE_JSON_FILE):
-        print(f"JSON file {AZURE_JSON_FILE} not found!")
-        return set()
 
-    try:
-        with open(AZURE_JSON_FILE, 'r') as file:
-            data = json.load(file)
-            azure_ips = set()
-
-            
-            if "values" in data:
-                for entry in data["values"]:
-                    if entry.get("name") == "AzureDevOps" or entry.get("id") == "AzureDevOps" or entry.get("systemService") == "AzureDevOps":
-                        if "properties" in entry and "addressPrefixes" in entry["properties"]:
-                            for ip in entry["properties"]["addressPrefixes"]:
-                                azure_ips.add(ip)
-
-            print(f" Found {len(azure_ips)} Azure DevOps IPs from JSON file")
-            return azure_ips
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-        return set()
-    except Exception as e:
-        print(f"Failed to read JSON: {e}")
-        return set()
-
-
-def add_azure_routes_to_server(base_url, api_token, api_secret, server_id):
-    azure_ips = get_azure_devops_ips()
-    if not azure_ips:
-        print("No Azure IPs found.")
-        return
-
-    
+@traced(args=('server_id',))
+def plan_azure_routes(base_url, api_token, api_secret, server_id, azure_ips):
+    """ Пре-стейдж: вычисляет маршруты для добавления, пока сервер работает. None - список маршрутов не получен. """
     existing_routes = get_existing_routes(base_url, api_token, api_secret, server_id)
+    if existing_routes is None:
+        return None
 
+    routes_to_add = set()
     for route in azure_ips:
         if route in existing_routes:
             print(f" Route {route} already exists on server {server_id}, skipping.")
         else:
-            add_route_to_server(base_url, api_token, api_secret, server_id, route)
+            routes_to_add.add(route)
+
+    return sorted(routes_to_add)
 
 
-def manage_server(base_url, api_token, api_secret, server_id, server_name):
+@traced(args=('server_id',))
+def manage_server(base_url, api_token, api_secret, server_id, server_name, azure_ips):
     print(f"\n Managing server: {server_name} ({server_id})")
 
-    
-    stop_url = f'{base_url}/server/{server_id}/operation/stop'
-    stop_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/stop')
-    stop_response = send_request(stop_url, 'PUT', stop_headers)
-    print(f'Server stop response: {stop_response}')
+    # Все чтение и сравнение выполняется до остановки сервера
+    routes_to_add = plan_azure_routes(base_url, api_token, api_secret, server_id, azure_ips)
+    if routes_to_add is None:
+        # Пустой список вместо ошибки привел бы к повторному добавлению всех маршрутов
+        print(f" Could not fetch routes for {server_id}, server left running.")
+        return SKIPPED, 'route listing failed'
+    if not routes_to_add:
+        print(f" No new routes for server {server_id}, server left running.")
+        return UNCHANGED, None
 
-    
-    add_azure_routes_to_server(base_url, api_token, api_secret, server_id)
+    try:
+        with mutation_window(server_id, {'job': JOB_NAME, 'add': routes_to_add}) as window:
+            if window is None:
+                return SKIPPED, 'changes applied by another job'
 
-    
-    start_url = f'{base_url}/server/{server_id}/operation/start'
-    start_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/start')
-    start_response = send_request(start_url, 'PUT', start_headers)
-    print(f' Server start response: {start_response}')
+            critical_started = time.monotonic()
+            request = functools.partial(signed_request, base_url, api_token, api_secret)
+            stop_server(request, server_id)
+
+            window.apply(request)
+            time_to_ready = start_server(request, server_id)
+            print(f' Critical section for {server_id} lasted {time.monotonic() - critical_started:.1f}s')
+    except ServerRetired as e:
+        print(f" {e}")
+        return SKIPPED, 'server replaced by blue/green rollout'
+
+    return start_result(time_to_ready)
 
 def main():
     settings = load_settings()
@@ -144,10 +146,25 @@ def main():
         return
 
     
+    azure_ips = get_source_ips(settings)
+    if azure_ips is None:
+        print("Some ip_sources could not be loaded, nothing changed.")
+        return
+    if not azure_ips:
+        print("No IPs found in ip_sources.")
+        return
+
+    results = {}
     for server in servers:
         server_id = server.get("id")
         server_name = server.get("name", "Unknown Server")
-        manage_server(base_url, api_token, api_secret, server_id, server_name)
+        results[server_id] = manage_server(base_url, api_token, api_secret, server_id, server_name, azure_ips)
+        if results[server_id][0] == FAILED:
+            print(f"Server {server_id} did not come back online, stopping rollout.")
+            break
+
+    print_rollout_summary(results)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
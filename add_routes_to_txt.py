@@ -7,16 +7,25 @@ import time
 import uuid
 import json
 import os
+import functools
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_shared
+from pritunl_server import FAILED, SKIPPED, UNCHANGED, print_rollout_summary, start_result, start_server, stop_server
+from pritunl_coord import ServerRetired, mutation_window
 
 SETTINGS_FILE = 'pritunl_settings.yml'
 ROUTES_FILE = 'routes_to_add.txt'
+JOB_NAME = 'add_routes_to_txt'
 CERT_PATH = ('/etc/ssl/my.crt', '/etc/ssl/my.key')  
 # Загрузка настроек из YAML файла
+@traced()
 def load_settings(filename=SETTINGS_FILE):
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -30,15 +39,16 @@ def create_signature(api_token, api_secret, method, path):
     }
 
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
-            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True, timeout=30)
         else:
-            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True)
+            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True, timeout=30)
 
         if response.status_code in [200, 201, 204]:
-            return response.json() if response.text else None
+            return response.json() if response.text else {}
         else:
             print(f' API Error {response.status_code}: {response.text}')
             return None
@@ -46,67 +56,77 @@ def send_request(url, method, headers, data=None):
         print(f" Request failed: {e}")
         return None
 
+@traced(args=('server_id',))
 def get_existing_routes(base_url, api_token, api_secret, server_id):
-    """ Получает список уже существующих маршрутов на сервере. """
+    """ Получает сети уже существующих маршрутов на сервере или None, если список получить не удалось. """
     url = f"{base_url}/server/{server_id}/route"
     headers = create_signature(api_token, api_secret, 'GET', f"/server/{server_id}/route")
 
-    routes = send_request(url, 'GET', headers)
-    if routes:
-        return {route["network"] for route in routes}  
-    return set()
+    routes = fetch_routes_shared(server_id, url, headers, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return None
+    try:
+        return {route["network"] for route in routes}
+    except RouteStreamError as e:
+        print(e)
+        return None
 
-def add_route_to_server(base_url, api_token, api_secret, server_id, route):
-    """ Добавляет новый маршрут в сервер Pritunl. """
-    url = f"{base_url}/server/{server_id}/route"
-    headers = create_signature(api_token, api_secret, 'POST', f"/server/{server_id}/route")
-    data = {"network": route}
+def signed_request(base_url, api_token, api_secret, method, path, data=None):
+    headers = create_signature(api_token, api_secret, method, path)
+    return send_request(f'{base_url}{path}', method, headers, data)
 
-    response = send_request(url, 'POST', headers, data)
-    if response:
-        print(f" Added route {route} to server {server_id}")
-    else:
-        print(f" Failed to add route {route} to server {server_id}")
+@traced(args=('server_id',))
+def plan_routes_from_file(base_url, api_token, api_secret, server_id, routes_to_add):
+    """ Маршруты из файла, которых еще нет на сервере (выполняется до остановки сервера). None - список маршрутов не получен. """
+    existing_routes = get_existing_routes(base_url, api_token, api_secret, server_id)
+    if existing_routes is None:
+        return None
+
+    new_routes = []
+    for route in sorted(routes_to_add):
+        if route in existing_routes:
+            print(f"Route {route} already exists on server {server_id}, skipping.")
+        else:
+            new_routes.append(route)
+    return new_routes
 
-def add_routes_from_file(base_url, api_token, api_secret, server_id):
-    """ Читает маршруты из файла и добавляет их в Pritunl. """
+def load_routes_from_file():
+    """ Читает маршруты из файла без дубликатов. """
     if not os.path.exists(ROUTES_FILE):
         print(f" No {ROUTES_FILE} file found.")
-        return
+        return set()
 
     with open(ROUTES_FILE, 'r') as file:
-        routes_to_add = {line.strip() for line in file.readlines() if line.strip()}  # Загружаем маршруты без дубликатов
-
-    if not routes_to_add:
-        print(" No routes found in file.")
-        return
+        return {line.strip() for line in file.readlines() if line.strip() and not line.startswith('#')}
+
+@traced(args=('server_id',))
+def manage_server(base_url, api_token, api_secret, server_id, routes_to_add):
+    new_routes = plan_routes_from_file(base_url, api_token, api_secret, server_id, routes_to_add)
+    if new_routes is None:
+        # Пустой список вместо ошибки привел бы к повторному добавлению всех маршрутов
+        print(f" Could not fetch routes for {server_id}, server left running.")
+        return SKIPPED, 'route listing failed'
+    if not new_routes:
+        print(f" No new routes for server {server_id}, server left running.")
+        return UNCHANGED, None
 
-    
-    existing_routes = get_existing_routes(base_url, api_token, api_secret, server_id)
+    try:
+        with mutation_window(server_id, {'job': JOB_NAME, 'add': new_routes}) as window:
+            if window is None:
+                return SKIPPED, 'changes applied by another job'
 
-    for route in routes_to_add:
-        if route in existing_routes:
-            print(f"Route {route} already exists on server {server_id}, skipping.")
-        else:
-            add_route_to_server(base_url, api_token, api_secret, server_id, route)
+            critical_started = time.monotonic()
+            request = functools.partial(signed_request, base_url, api_token, api_secret)
+            stop_server(request, server_id)
 
-def manage_server(base_url, api_token, api_secret, server_id):
-   
-    
-    
-    stop_url = f'{base_url}/server/{server_id}/operation/stop'
-    stop_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/stop')
-    stop_response = send_request(stop_url, 'PUT', stop_headers)
-    print(f'Server stop response: {stop_response}')
+            window.apply(request)
+            time_to_ready = start_server(request, server_id)
+            print(f' Critical section for {server_id} lasted {time.monotonic() - critical_started:.1f}s')
+    except ServerRetired as e:
+        print(f" {e}")
+        return SKIPPED, 'server replaced by blue/green rollout'
 
-    
-    add_routes_from_file(base_url, api_token, api_secret, server_id)
-
-    
-    start_url = f'{base_url}/server/{server_id}/operation/start'
-    start_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/start')
-    start_response = send_request(start_url, 'PUT', start_headers)
-    print(f' Server start response: {start_response}')
+    return start_result(time_to_ready)
 
 def main():
     settings = load_settings()
@@ -119,12 +139,24 @@ def main():
         print(" No servers found in pritunl_settings.yml")
         return
 
+    routes_to_add = load_routes_from_file()
+    if not routes_to_add:
+        print(" No routes found in file.")
+        return
+
     
+    results = {}
     for server in servers:
         server_id = server.get("id")
         server_name = server.get("name", "Unknown Server")
         print(f"\n Managing server: {server_name} ({server_id})")
-        manage_server(base_url, api_token, api_secret, server_id)
+        results[server_id] = manage_server(base_url, api_token, api_secret, server_id, routes_to_add)
+        if results[server_id][0] == FAILED:
+            print(f"Server {server_id} did not come back online, stopping rollout.")
+            break
+
+    print_rollout_summary(results)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
@@ -0,0 +1,475 @@
+"""
+Blue/green обновление маршрутов без долгой остановки сервера.
+
+deploy:   клонирует конфигурацию сервера в резервный (standby) сервер, пока основной работает,
+          применяет на нем новый набор маршрутов и подключает те же хосты. Затем за одно
+          переключение останавливает основной, переносит организации и запускает резервный.
+          Старый сервер остается остановленным для мгновенного отката. При неудаче до
+          переключения резервный сервер удаляется.
+rollback: возвращает организации на предыдущий сервер, запускает его и удаляет резервный.
+cleanup:  удаляет сервер, оставленный для отката, и освобождает его порт и сеть. Следующий
+          deploy делает это сам и по умолчанию берет освободившиеся порт и сеть.
+
+Новый набор маршрутов = текущие маршруты сервера - routes_to_delete.txt + routes_to_add.txt.
+При --with-sources добавляются ip_sources из настроек, а из routes_to_delete.txt (его пишет
+add-routeAZ_to_del.py - все маршруты из источников) удаляются только префиксы, которых
+в источниках больше нет.
+"""
+import argparse
+import base64
+import datetime
+import functools
+import hashlib
+import hmac
+import ipaddress
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yaml
+
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_stream
+from ip_ranges import load_sources
+from pritunl_server import get_server_status, start_server, stop_server
+from pritunl_coord import atomic_write, file_lock, retire_server, server_lock, settings_lock
+
+SETTINGS_FILE = 'pritunl_settings.yml'
+ROUTES_ADD_FILE = 'routes_to_add.txt'
+ROUTES_DELETE_FILE = 'routes_to_delete.txt'
+STATE_FILE = 'bluegreen_state.yml'
+CERT_PATH = ('/etc/ssl/my.crt', '/etc/ssl/my.key')
+ROUTE_WORKERS = 8
+
+# Поля GET /server/{id}, которые описывают состояние, а не конфигурацию
+SERVER_RUNTIME_FIELDS = {'id', 'status', 'uptime', 'users_online', 'devices_online', 'user_count',
+                         'instances', 'instances_count', 'organizations'}
+ROUTE_COPY_FIELDS = ('network', 'comment', 'metric', 'nat', 'nat_interface', 'nat_netmap', 'advertise', 'net_gateway')
+
+
+def load_settings(filename=SETTINGS_FILE):
+    with open(filename, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def save_settings(settings, filename=SETTINGS_FILE):
+    atomic_write(filename, lambda file: yaml.dump(settings, file, default_flow_style=False, allow_unicode=True))
+
+    print(f"Settings updated in {filename}")
+
+
+@traced('sign', args=('method', 'path'))
+def create_signature(api_token, api_secret, method, path):
+    timestamp = str(int(time.time()))
+    nonce = uuid.uuid4().hex
+    auth_string = '&'.join([api_token, timestamp, nonce, method.upper(), path])
+    signature = hmac.new(api_secret.encode(), auth_string.encode(), hashlib.sha256).digest()
+    return {
+        'Auth-Token': api_token,
+        'Auth-Timestamp': timestamp,
+        'Auth-Nonce': nonce,
+        'Auth-Signature': base64.b64encode(signature).decode()
+    }
+
+
+@traced('http', args=('method', 'url'))
+def send_request(url, method, headers, data=None):
+    try:
+        if data:
+            response = requests.request(method, url, headers=headers, json=data, cert=CERT_PATH, verify=True, timeout=30)
+        else:
+            response = requests.request(method, url, headers=headers, cert=CERT_PATH, verify=True, timeout=30)
+
+        if response.status_code in [200, 201, 204]:
+            return response.json() if response.text else {}
+        else:
+            print(f'API Error {response.status_code}: {response.text}')
+            return None
+    except requests.exceptions.RequestException as e:
+        print(f" Request failed: {e}")
+        return None
+
+
+def call_api(api, method, path, data=None):
+    base_url, api_token, api_secret = api
+    headers = create_signature(api_token, api_secret, method, path)
+    return send_request(f'{base_url}{path}', method, headers, data)
+
+
+def load_lines(filename):
+    if not os.path.exists(filename):
+        return set()
+
+    with open(filename, 'r') as file:
+        return {line.strip() for line in file if line.strip() and not line.startswith('#')}
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+
+    with open(STATE_FILE, 'r') as file:
+        return yaml.safe_load(file) or {}
+
+
+def save_state(state):
+    atomic_write(STATE_FILE, lambda file: yaml.dump(state, file, default_flow_style=False, allow_unicode=True))
+
+
+def update_state(server_id, record):
+    """ Добавляет (record) или удаляет (None) запись о переключении; файл общий для всех серверов. """
+    with file_lock('bluegreen_state'):
+        state = load_state()
+        if record is None:
+            state.pop(server_id, None)
+        else:
+            state[server_id] = record
+        save_state(state)
+
+
+def get_attached(api, kind, server_id):
+    """ Список ID организаций (kind='organization') или хостов (kind='host') сервера. """
+    items = call_api(api, 'GET', f'/server/{server_id}/{kind}')
+    if items is None:
+        return None
+    return [item['id'] for item in items]
+
+
+def set_attached(api, kind, server_id, item_ids, attach=True):
+    method = 'PUT' if attach else 'DELETE'
+    ok = True
+    for item_id in item_ids:
+        if call_api(api, method, f'/server/{server_id}/{kind}/{item_id}') is None:
+            print(f" Failed to {'attach' if attach else 'detach'} {kind} {item_id} on {server_id}")
+            ok = False
+    return ok
+
+
+def delete_server(api, server_id):
+    """ Удаляет резервный сервер после неудачи или сервер, выведенный из работы. """
+    if call_api(api, 'DELETE', f'/server/{server_id}') is None:
+        print(f" Failed to delete server {server_id}, delete it manually")
+        return False
+    print(f" Deleted server {server_id}")
+    return True
+
+
+def is_service_route(route, server):
+    """ Маршрут виртуальной сети и линки создаются Pritunl автоматически и не переносятся. """
+    return route.get('virtual_network') or route.get('link') or route.get('network') == server.get('network')
+
+
+@traced()
+def plan_route_set(api, server, settings, with_sources):
+    """ Пре-стейдж: новый набор маршрутов {network: payload} для резервного сервера. """
+    to_delete = load_lines(ROUTES_DELETE_FILE)
+    extra = set(load_lines(ROUTES_ADD_FILE))
+    if with_sources and settings.get('ip_sources'):
+        sources = load_sources(settings['ip_sources'])
+        if sources is None:
+            return None
+        # Префиксы из источников остаются, даже если они перечислены в routes_to_delete.txt
+        extra.update(sources)
+        to_delete -= set(sources)
+
+    routes = fetch_routes_stream(f"{api[0]}/server/{server['id']}/route",
+                                 create_signature(api[1], api[2], 'GET', f"/server/{server['id']}/route"),
+                                 fields=None, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return None
+
+    desired = {}
+    try:
+        for route in routes:
+            if is_service_route(route, server) or route['network'] in to_delete:
+                continue
+            desired[route['network']] = {key: route[key] for key in ROUTE_COPY_FIELDS if route.get(key) is not None}
+    except RouteStreamError as e:
+        print(e)
+        return None
+
+    for network in sorted(extra - to_delete):
+        try:
+            ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            print(f" Invalid network {network}, skipping.")
+            continue
+        desired.setdefault(network, {'network': network})
+
+    print(f" New route set for {server['id']}: {len(desired)} routes")
+    return desired
+
+
+def get_route_networks(api, server):
+    """ Подсети маршрутов сервера без служебных (для записи в настройки) или None при ошибке. """
+    routes = fetch_routes_stream(f"{api[0]}/server/{server['id']}/route",
+                                 create_signature(api[1], api[2], 'GET', f"/server/{server['id']}/route"),
+                                 fields=None, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return None
+    try:
+        return sorted(route['network'] for route in routes if not is_service_route(route, server))
+    except RouteStreamError as e:
+        print(e)
+        return None
+
+
+@traced()
+def create_standby(api, server, port, network):
+    config = {key: value for key, value in server.items() if key not in SERVER_RUNTIME_FIELDS}
+    config['name'] = f"{server['name']}-{time.strftime('%Y%m%d%H%M%S')}"
+    config['port'] = port
+    config['network'] = network
+
+    standby = call_api(api, 'POST', '/server', config)
+    if standby:
+        print(f" Created standby server {standby['name']} ({standby['id']}) on port {port}, network {network}")
+    return standby
+
+
+@traced(args=('server_id',))
+def apply_route_set(api, server_id, standby, desired):
+    """ Приводит маршруты остановленного резервного сервера к желаемому набору. """
+    existing = {}
+    routes = fetch_routes_stream(f'{api[0]}/server/{server_id}/route',
+                                 create_signature(api[1], api[2], 'GET', f'/server/{server_id}/route'),
+                                 fields=None, cert=CERT_PATH, verify=True, timeout=30)
+    if routes is None:
+        return False
+    try:
+        for route in routes:
+            if not is_service_route(route, standby):
+                existing[route['network']] = route['id']
+    except RouteStreamError as e:
+        print(e)
+        return False
+
+    stale = [route_id for network, route_id in existing.items() if network not in desired]
+    missing = [payload for network, payload in desired.items() if network not in existing]
+
+    with ThreadPoolExecutor(max_workers=ROUTE_WORKERS) as executor:
+        deleted = list(executor.map(
+            lambda route_id: call_api(api, 'DELETE', f'/server/{server_id}/route/{route_id}') is not None, stale))
+        added = list(executor.map(
+            lambda payload: call_api(api, 'POST', f'/server/{server_id}/route', payload) is not None, missing))
+
+    print(f" Standby {server_id}: {sum(added)} of {len(added)} routes added, {sum(deleted)} of {len(deleted)} removed")
+    return all(added) and all(deleted)
+
+
+@traced()
+def switch_over(api, old_id, new_id, organizations):
+    """
+    Единственное окно недоступности: останавливает старый сервер, переносит организации, запускает новый.
+    Если какой-то шаг не удался, переключение отменяется. Возвращает время готовности нового сервера
+    или None; после None старый сервер снова работает, если это удалось (см. revert_switch).
+    """
+    request = functools.partial(call_api, api)
+    switch_started = time.monotonic()
+
+    # Организации переносятся только между остановленными серверами, поэтому шаги строго по порядку
+    time_to_ready = None
+    if not stop_server(request, old_id):
+        print(f" Failed to stop {old_id}")
+    elif not set_attached(api, 'organization', old_id, organizations, attach=False) or \
+            not set_attached(api, 'organization', new_id, organizations):
+        print(f" Failed to move organizations from {old_id} to {new_id}")
+    else:
+        time_to_ready = start_server(request, new_id)
+
+    if time_to_ready is None:
+        print(f" Switchover {old_id} -> {new_id} failed, reverting")
+        revert_switch(api, old_id, new_id, organizations)
+    print(f' Switchover {old_id} -> {new_id} lasted {time.monotonic() - switch_started:.1f}s')
+    return time_to_ready
+
+
+def revert_switch(api, old_id, new_id, organizations):
+    """
+    Возвращает организации на старый сервер и запускает его. True, если старый снова online.
+    Оба сервера сначала останавливаются: переключение могло прерваться на любом шаге.
+    """
+    request = functools.partial(call_api, api)
+    stop_server(request, new_id)
+    stop_server(request, old_id)
+    set_attached(api, 'organization', new_id, organizations, attach=False)
+    set_attached(api, 'organization', old_id, organizations)
+    if start_server(request, old_id) is None:
+        print(f" {old_id} did not come back online")
+        return False
+    return True
+
+
+def update_settings_server(old_id, server, routes=None):
+    """ Переводит записи servers/routes в настройках со старого сервера на новый (файл перечитывается под блокировкой). """
+    with settings_lock():
+        settings = load_settings()
+        for item in settings.get('servers', []):
+            if item.get('id') == old_id:
+                item.update({key: server[key] for key in ('id', 'name', 'port', 'network') if key in server})
+        for item in settings.get('routes', []):
+            if item.get('server_id') == old_id:
+                item['server_id'] = server['id']
+                if routes is not None:
+                    item['network'] = routes
+        save_settings(settings)
+
+
+@traced(args=('server_id',))
+def deploy(api, settings, server_id, standby_port, standby_network, with_sources):
+    server = call_api(api, 'GET', f'/server/{server_id}')
+    if not server:
+        print(f"Server {server_id} not found")
+        return None
+    print(f"\n Blue/green rollout for {server['name']} ({server_id})")
+
+    # Все, что можно сделать при работающем сервере
+    desired = plan_route_set(api, server, settings, with_sources)
+    organizations = get_attached(api, 'organization', server_id)
+    hosts = get_attached(api, 'host', server_id)
+    if desired is None or organizations is None or hosts is None:
+        print(f"Could not read configuration of {server_id}, nothing changed.")
+        return None
+
+    # Новый выпуск заменяет точку отката: прежний сервер удаляется, его порт и сеть освобождаются
+    retired = cleanup(api, server_id)
+    if retired is None:
+        return None
+    standby_port = standby_port or retired.get('port') or server['port'] + 1
+    standby_network = standby_network or retired.get('network')
+    if not standby_network:
+        print(f"No network for the standby of {server_id}: pass --standby-network")
+        return None
+
+    standby = create_standby(api, server, standby_port, standby_network)
+    if not standby:
+        return None
+    if not apply_route_set(api, standby['id'], standby, desired) or \
+            not set_attached(api, 'host', standby['id'], hosts):
+        print(f"Standby {standby['id']} is not ready, production server left untouched.")
+        delete_server(api, standby['id'])
+        return None
+
+    time_to_ready = switch_over(api, server_id, standby['id'], organizations)
+    if time_to_ready is None:
+        if get_server_status(functools.partial(call_api, api), server_id) == 'online':
+            print(f"Switchover to standby {standby['id']} failed, {server_id} is back online.")
+            delete_server(api, standby['id'])
+        else:
+            print(f"Switchover failed and {server_id} did not come back, standby {standby['id']} kept for investigation")
+        return None
+
+    # Изменения, поставленные в очередь старого сервера во время переключения, к нему больше не применяются
+    retire_server(server_id, standby['id'])
+    update_state(standby['id'], {
+        'previous': server_id,
+        'organizations': organizations,
+        'switched_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    })
+    update_settings_server(server_id, standby, sorted(desired))
+    print(f" Previous server {server_id} kept offline for rollback: "
+          f"python3 bluegreen_rollout.py rollback --server-id {standby['id']}")
+    return time_to_ready
+
+
+@traced(args=('server_id',))
+def rollback(api, settings, server_id):
+    state = load_state()
+    record = state.get(server_id)
+    if not record:
+        print(f"No blue/green record for {server_id} in {STATE_FILE}")
+        return None
+
+    previous = call_api(api, 'GET', f"/server/{record['previous']}")
+    if not previous:
+        print(f"Previous server {record['previous']} not found")
+        return None
+    routes = get_route_networks(api, previous)
+    if routes is None:
+        print(f"Could not read routes of {previous['id']}, nothing changed.")
+        return None
+
+    time_to_ready = switch_over(api, server_id, previous['id'], record['organizations'])
+    if time_to_ready is None:
+        print(f"Rollback to {previous['id']} failed, {server_id} left in place.")
+        return None
+
+    retire_server(server_id, previous['id'])
+    update_state(server_id, None)
+    update_settings_server(server_id, previous, routes)
+    delete_server(api, server_id)
+    return time_to_ready
+
+
+@traced(args=('server_id',))
+def cleanup(api, server_id):
+    """
+    Удаляет сервер, оставленный для отката на server_id, и запись о переключении.
+    Возвращает удаленный сервер ({} если удалять нечего) или None, если удалить не удалось.
+    """
+    record = load_state().get(server_id)
+    if not record:
+        return {}
+
+    servers = call_api(api, 'GET', '/server')
+    if servers is None:
+        return None
+    previous = next((server for server in servers if server['id'] == record['previous']), None)
+    if previous is None:
+        print(f" Previous server {record['previous']} is already gone")
+        update_state(server_id, None)
+        return {}
+    if previous.get('status') == 'online':
+        print(f" Previous server {previous['id']} is online, not deleting it")
+        return None
+    if not delete_server(api, previous['id']):
+        return None
+
+    update_state(server_id, None)
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Blue/green route rollout via a standby server')
+    parser.add_argument('action', choices=['deploy', 'rollback', 'cleanup'])
+    parser.add_argument('--server-id', help='server to roll out (default: the only server in settings)')
+    parser.add_argument('--standby-network',
+                        help='virtual network of the standby server, must not overlap (default: of the retired server)')
+    parser.add_argument('--standby-port', type=int,
+                        help='port of the standby server (default: of the retired server, else port + 1)')
+    parser.add_argument('--with-sources', action='store_true', help='also add prefixes from ip_sources')
+    args = parser.parse_args()
+
+    settings = load_settings()
+    api = (settings['base_url'], settings['api_token'], settings['api_secret'])
+
+    server_id = args.server_id
+    if args.action != 'deploy':
+        if not server_id:
+            parser.error(f'{args.action} requires --server-id')
+    else:
+        if not server_id:
+            servers = settings.get('servers', [])
+            if len(servers) != 1:
+                parser.error('deploy one server at a time: pass --server-id')
+            server_id = servers[0]['id']
+
+    # Переключение не должно пересекаться с другими заданиями, которые меняют этот сервер
+    with server_lock(server_id, blocking=False) as acquired:
+        if not acquired:
+            print(f"Server {server_id} is being changed by another job, try again later.")
+            return
+        if args.action == 'rollback':
+            rollback(api, settings, server_id)
+        elif args.action == 'cleanup':
+            if cleanup(api, server_id) == {}:
+                print(f"Nothing to clean up for {server_id}")
+        else:
+            deploy(api, settings, server_id, args.standby_port, args.standby_network, args.with_sources)
+
+if __name__ == '__main__':
+    install_cassette()
+    profile_main(main)
@@ -7,16 +7,26 @@ import time
 import uuid
 import yaml
 import os
+import argparse
+import functools
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_shared, write_routes_yaml
+from pritunl_server import FAILED, SKIPPED, UNCHANGED, print_rollout_summary, start_result, start_server, stop_server
+from pritunl_coord import ServerRetired, mutation_window
 
 BACKUP_DIR = 'routes_backup'
 SETTINGS_FILE = 'pritunl_settings.yml'
 ROUTES_DELETE_FILE = 'routes_to_delete.txt'
+JOB_NAME = 'delete_route'
 
+@traced()
 def load_settings(filename=SETTINGS_FILE):
    
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -29,6 +39,7 @@ def create_signature(api_token, api_secret, method, path):
         'Auth-Signature': base64.b64encode(signature).decode()
     }
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
@@ -37,7 +48,7 @@ def send_request(url, method, headers, data=None):
             response = requests.request(method, url, headers=headers, verify=True, timeout=30)
 
         if response.status_code in [200, 204]:
-            return response.json() if response.text else None  
+            return response.json() if response.text else {}
         else:
             print(f'Error: {response.status_code}, Message: {response.text}')
             return None
@@ -53,63 +64,117 @@ def load_backup_routes(server_id):
         with open(filename, 'r') as file:
             data = yaml.safe_load(file)
             return {route['network']: route['id'] for route in data.get('routes', [])}  
-        print(f"No backup routes found for {server_id}")
-        return {}
+    print(f"No backup routes found for {server_id}")
+    return {}
 
 def load_routes_to_delete():
    
     if os.path.exists(ROUTES_DELETE_FILE):
         with open(ROUTES_DELETE_FILE, 'r') as file:
-            return {line.strip() for line in file.readlines() if line.strip()}  
+            return {line.strip() for line in file.readlines() if line.strip() and not line.strip().startswith('#')}  
     else:
         print(f"No routes_to_delete.txt file found")
         return set()
 
-def manage_server(base_url, api_token, api_secret, server_id, routes):
-  
-    
-   
-    stop_url = f'{base_url}/server/{server_id}/operation/stop'
-    stop_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/stop')
-    stop_response = send_request(stop_url, 'PUT', stop_headers)
-    print(f'Server stop response: {stop_response}')
+@traced(args=('server_id',))
+def get_live_routes(base_url, api_token, api_secret, server_id):
+    """ Получает актуальный список маршрутов сервера одним потоковым запросом. """
+    url = f'{base_url}/server/{server_id}/route'
+    headers = create_signature(api_token, api_secret, 'GET', f'/server/{server_id}/route')
+    return fetch_routes_shared(server_id, url, headers, verify=True, timeout=30)
 
-    
-    backup_routes = load_backup_routes(server_id)  
-    routes_to_delete = load_routes_to_delete()  
+@traced(args=('server_id',))
+def save_routes_to_yaml(server_id, routes):
+    """ Обновляет локальный снимок маршрутов в BACKUP_DIR. """
+    filename = os.path.join(BACKUP_DIR, f'server_{server_id}_routes.yml')
+    count = write_routes_yaml(server_id, routes, filename)
+    if count is not None:
+        print(f"{count} routes saved to {filename}")
+
+def signed_request(base_url, api_token, api_secret, method, path, data=None):
+    headers = create_signature(api_token, api_secret, method, path)
+    return send_request(f'{base_url}{path}', method, headers, data)
+
+@traced(args=('server_id',))
+def manage_server(base_url, api_token, api_secret, server_id, routes, live=False):
+    """
+    Возвращает (статус, значение) из pritunl_server: READY и время готовности сервера,
+    UNCHANGED, SKIPPED и причину пропуска или FAILED, если сервер не запустился.
+    """
+    routes_to_delete = load_routes_to_delete()
+
+    if live:
+        live_routes = get_live_routes(base_url, api_token, api_secret, server_id)
+        route_index = None
+        if live_routes is not None:
+            try:
+                route_index = {route['network']: route['id'] for route in live_routes}
+            except RouteStreamError as e:
+                print(e)
+        if route_index is None:
+            print(f"Could not fetch routes for {server_id}, server left running.")
+            return SKIPPED, 'route listing failed'
+        snapshot = ({'id': route_id, 'network': network} for network, route_id in route_index.items())
+    else:
+        route_index = load_backup_routes(server_id)
 
-    
-    matched_routes = {network: route_id for network, route_id in backup_routes.items() if network in routes_to_delete}
+    matched_routes = {network: route_id for network, route_id in route_index.items() if network in routes_to_delete}
 
-    
-    if matched_routes:
-        for network, route_id in matched_routes.items():
-            delete_route_url = f'{base_url}/server/{server_id}/route/{route_id}'
-            delete_route_headers = create_signature(api_token, api_secret, 'DELETE', f'/server/{server_id}/route/{route_id}')
-            delete_route_response = send_request(delete_route_url, 'DELETE', delete_route_headers)
-            print(f'Deleted route {network} (ID: {route_id}): {delete_route_response}')
-    else:
-        print("No matching routes found for deletion.")
+    if not matched_routes:
+        print("No matching routes found for deletion, server left running.")
+        if live:
+            save_routes_to_yaml(server_id, snapshot)
+        return UNCHANGED, None
 
-   
-    start_url = f'{base_url}/server/{server_id}/operation/start'
-    start_headers = create_signature(api_token, api_secret, 'PUT', f'/server/{server_id}/operation/start')
-    start_response = send_request(start_url, 'PUT', start_headers)
-    print(f'Server start response: {start_response}')
+    try:
+        with mutation_window(server_id, {'job': JOB_NAME, 'delete': matched_routes}) as window:
+            if window is None:
+                return SKIPPED, 'changes applied by another job'
+
+            request = functools.partial(signed_request, base_url, api_token, api_secret)
+            stop_server(request, server_id)
+
+            _, deleted = window.apply(request)
+            failed = sorted(set(matched_routes) - deleted)
+            print(f'Deleted {len(matched_routes) - len(failed)} of {len(matched_routes)} routes')
+            if failed:
+                print(f'Failed routes: {", ".join(failed)}')
+
+            time_to_ready = start_server(request, server_id)
+    except ServerRetired as e:
+        print(f" {e}")
+        return SKIPPED, 'server replaced by blue/green rollout'
+
+    # Снимок пишется после запуска, чтобы не удлинять простой сервера
+    if live:
+        save_routes_to_yaml(server_id, (route for route in snapshot if route['network'] not in deleted))
+    return start_result(time_to_ready)
 
 def main():
+    parser = argparse.ArgumentParser(description='Delete routes listed in routes_to_delete.txt')
+    parser.add_argument('--live', action='store_true',
+                        help='resolve route ids from the live server instead of routes_backup')
+    args = parser.parse_args()
+
     settings = load_settings()
     base_url = settings['base_url']
     api_token = settings['api_token']
     api_secret = settings['api_secret']
 
     
+    results = {}
     for item in settings.get('routes', []):
         server_id = item['server_id']
         routes = item.get('network', [])
         
         print(f"\nManaging server: {server_id}")
-        manage_server(base_url, api_token, api_secret, server_id, routes)
+        results[server_id] = manage_server(base_url, api_token, api_secret, server_id, routes, live=args.live)
+        if results[server_id][0] == FAILED:
+            print(f"Server {server_id} did not come back online, stopping rollout.")
+            break
+
+    print_rollout_summary(results)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
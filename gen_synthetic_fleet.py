@@ -0,0 +1,119 @@
+import argparse
+import ipaddress
+import json
+import os
+import random
+import yaml
+
+SETTINGS_FILE = 'pritunl_settings.yml'
+AZURE_JSON_FILE = 'ServiceTags_Public_20250203.json'
+ROUTES_DELETE_FILE = 'routes_to_delete.txt'
+AZURE_TAGS = ['AzureDevOps', 'AzureCloud.westeurope']
+FILLER_TAG_SIZE = 500
+
+SERVER_ROUTE_BASE = ipaddress.IPv4Address('10.0.0.0')
+AZURE_PREFIX_BASE = ipaddress.IPv4Address('20.0.0.0')
+FILLER_PREFIX_BASE = ipaddress.IPv4Address('40.0.0.0')
+
+
+def make_prefixes(base, count, prefixlen, offset=0):
+    """ Возвращает count последовательных подсетей заданной длины, начиная с base. """
+    size = 2 ** (32 - prefixlen)
+    return [str(ipaddress.IPv4Network((int(base) + (offset + i) * size, prefixlen))) for i in range(count)]
+
+
+def generate_service_tags(total_prefixes, azure_share=0.4):
+    """ Формирует ServiceTags JSON: часть префиксов в тегах AzureDevOps/westeurope, остальное в фоновых тегах. """
+    azure_count = max(len(AZURE_TAGS), int(total_prefixes * azure_share))
+    azure_prefixes = make_prefixes(AZURE_PREFIX_BASE, azure_count, 26)
+    filler_prefixes = make_prefixes(FILLER_PREFIX_BASE, max(0, total_prefixes - azure_count), 26)
+
+    values = []
+    for index, tag in enumerate(AZURE_TAGS):
+        values.append(service_tag(tag, azure_prefixes[index::len(AZURE_TAGS)]))
+    for start in range(0, len(filler_prefixes), FILLER_TAG_SIZE):
+        values.append(service_tag(f'Synthetic.tag{start // FILLER_TAG_SIZE}', filler_prefixes[start:start + FILLER_TAG_SIZE]))
+
+    return {'changeNumber': 1, 'cloud': 'Public', 'values': values}, azure_prefixes
+
+
+def service_tag(name, prefixes):
+    return {
+        'name': name,
+        'id': name,
+        'properties': {
+            'changeNumber': 1,
+            'region': name.split('.', 1)[1] if '.' in name else '',
+            'systemService': name.split('.', 1)[0],
+            'addressPrefixes': prefixes,
+        },
+    }
+
+
+def generate_fleet(servers, routes, overlap, azure_prefixes, base_url, seed=0):
+    """ Формирует pritunl_settings.yml: servers серверов по routes маршрутов, доля overlap взята из Azure-префиксов. """
+    rng = random.Random(seed)
+    overlap_count = min(int(routes * overlap), len(azure_prefixes))
+
+    settings = {
+        'api_secret': 'synthetic_secret',
+        'api_token': 'synthetic_token',
+        'base_url': base_url,
+        'routes': [],
+        'servers': [],
+    }
+    overlapping = set()
+    for index in range(servers):
+        server_id = f'{index + 1:024x}'
+        shared = rng.sample(azure_prefixes, overlap_count)
+        unique = make_prefixes(SERVER_ROUTE_BASE, routes - overlap_count, 24, offset=index * routes)
+        overlapping.update(shared)
+
+        settings['routes'].append({'server_id': server_id, 'network': unique + shared})
+        settings['servers'].append({
+            'id': server_id,
+            'name': f'synthetic-{index + 1}',
+            'dns_servers': ['8.8.8.8'],
+            'nat': False,
+            'net_gateway': False,
+            'network': str(ipaddress.IPv4Network((int(ipaddress.IPv4Address('172.16.0.0')) + index * 256, 24))),
+            'port': 15000 + index,
+        })
+
+    return settings, overlapping
+
+
+def write_fleet(output_dir, servers, routes, overlap, tag_prefixes, base_url, seed=0):
+    os.makedirs(output_dir, exist_ok=True)
+
+    service_tags, azure_prefixes = generate_service_tags(tag_prefixes)
+    settings, overlapping = generate_fleet(servers, routes, overlap, azure_prefixes, base_url, seed)
+
+    with open(os.path.join(output_dir, SETTINGS_FILE), 'w') as file:
+        yaml.dump(settings, file, default_flow_style=False, allow_unicode=True)
+    with open(os.path.join(output_dir, AZURE_JSON_FILE), 'w') as file:
+        json.dump(service_tags, file)
+    with open(os.path.join(output_dir, ROUTES_DELETE_FILE), 'w') as file:
+        for route in sorted(overlapping):
+            file.write(route + '\n')
+
+    print(f"Generated {servers} servers x {routes} routes (overlap {overlap:.0%}), "
+          f"{tag_prefixes} ServiceTags prefixes in {output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Pritunl fleet and ServiceTags JSON')
+    parser.add_argument('--servers', type=int, default=10, help='number of servers (N)')
+    parser.add_argument('--routes', type=int, default=100, help='routes per server (M)')
+    parser.add_argument('--overlap', type=float, default=0.2,
+                        help='share of each server routes taken from the Azure tags (0..1)')
+    parser.add_argument('--tag-prefixes', type=int, default=5000, help='total prefixes in ServiceTags JSON')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8443', help='base_url written to settings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default='synthetic_fleet')
+    args = parser.parse_args()
+
+    write_fleet(args.output_dir, args.servers, args.routes, args.overlap, args.tag_prefixes, args.base_url, args.seed)
+
+if __name__ == '__main__':
+    main()
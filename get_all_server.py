@@ -7,9 +7,14 @@ import time
 import uuid
 import yaml
 import os
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import RouteStreamError, fetch_routes_stream
+from pritunl_coord import atomic_write, settings_lock
 
 SETTINGS_FILE = 'pritunl_settings.yml'
 
+@traced()
 def load_settings(filename=SETTINGS_FILE):
     """ Загружает конфигурацию из YAML-файла. """
     if os.path.exists(filename):
@@ -17,13 +22,14 @@ def load_settings(filename=SETTINGS_FILE):
             return yaml.safe_load(file)
     return {"routes": []} 
 
+@traced()
 def save_settings(settings, filename=SETTINGS_FILE):
   
-    with open(filename, 'w') as file:
-        yaml.dump(settings, file, default_flow_style=False, allow_unicode=True)
+    atomic_write(filename, lambda file: yaml.dump(settings, file, default_flow_style=False, allow_unicode=True))
 
     print(f"Settings updated in {filename}")
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
    
     timestamp = str(int(time.time()))
@@ -37,6 +43,7 @@ def create_signature(api_token, api_secret, method, path):
         'Auth-Signature': base64.b64encode(signature).decode()
     }
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers):
   
     try:
@@ -50,6 +57,7 @@ def send_request(url, method, headers):
         print(f" Request failed: {e}")
         return None
 
+@traced()
 def get_all_servers(base_url, api_token, api_secret):
     
     url = f"{base_url}/server"
@@ -65,6 +73,7 @@ def get_all_servers(base_url, api_token, api_secret):
         print(" No servers found or error occurred.")
         return []
 
+@traced(args=('server_id',))
 def get_server_details(base_url, api_token, api_secret, server_id):
     """ Получает конфигурацию сервера, включая сети. """
     url = f"{base_url}/server/{server_id}"
@@ -77,16 +86,21 @@ def get_server_details(base_url, api_token, api_secret, server_id):
         return server_data
     return {}
 
+@traced(args=('server_id',))
 def get_server_routes(base_url, api_token, api_secret, server_id):
     """ Получает маршруты для указанного сервера. """
     url = f"{base_url}/server/{server_id}/route"
     headers = create_signature(api_token, api_secret, 'GET', f"/server/{server_id}/route")
 
-    routes = send_request(url, 'GET', headers)
-    if routes:
-        return [route.get("network") for route in routes if "network" in route]  
+    routes = fetch_routes_stream(url, headers, fields=('network',), verify=True, timeout=30)
+    if routes is not None:
+        try:
+            return [route["network"] for route in routes if route["network"]]
+        except RouteStreamError as e:
+            print(e)
     return []
 
+@traced()
 def update_pritunl_settings(base_url, api_token, api_secret):
    
     settings = load_settings()
@@ -121,12 +135,19 @@ def update_pritunl_settings(base_url, api_token, api_secret):
                 "routes_to_delete": []
             })
 
-    if new_servers:
-        settings.setdefault("routes", []).extend(new_servers)
-        save_settings(settings)
-        print(f" Added {len(new_servers)} new servers with network settings to {SETTINGS_FILE}")
-    else:
+    if not new_servers:
         print(" No new servers found to add.")
+        return
+
+    # Пока шли запросы к API, файл мог изменить другой скрипт: перечитываем его под блокировкой
+    with settings_lock():
+        settings = load_settings()
+        existing_servers = {srv["server_id"] for srv in settings.get("routes", [])}
+        new_servers = [srv for srv in new_servers if srv["server_id"] not in existing_servers]
+        if new_servers:
+            settings.setdefault("routes", []).extend(new_servers)
+            save_settings(settings)
+    print(f" Added {len(new_servers)} new servers with network settings to {SETTINGS_FILE}")
 
 def main():
     settings = load_settings()
@@ -142,4 +163,5 @@ def main():
     update_pritunl_settings(base_url, api_token, api_secret)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
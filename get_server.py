@@ -1,5 +1,4 @@
 import requests
-import json
 import hmac
 import hashlib
 import base64
@@ -7,11 +6,17 @@ import time
 import uuid
 import yaml
 import os
+import argparse
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import fetch_routes_stream, write_routes_yaml
 
+@traced()
 def load_settings(filename='pritunl_settings.yml'):
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -24,6 +29,7 @@ def create_signature(api_token, api_secret, method, path):
         'Auth-Signature': base64.b64encode(signature).decode()
     }
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
@@ -40,29 +46,39 @@ def send_request(url, method, headers, data=None):
         print(f"Request failed: {e}")
         return None
 
-def get_server_routes(base_url, api_token, api_secret, server_id):
-    """ Получает список маршрутов для указанного сервера и сохраняет в YAML. """
+@traced(args=('server_id',))
+def get_server_routes(base_url, api_token, api_secret, server_id, verbose=False):
+    """ Потоково получает маршруты сервера и сразу пишет их в YAML. Возвращает число маршрутов. """
     url = f'{base_url}/server/{server_id}/route'
     headers = create_signature(api_token, api_secret, 'GET', f'/server/{server_id}/route')
-    
-    routes = send_request(url, 'GET', headers)
-    if routes is not None:
-        print(f'Routes for server {server_id}: {json.dumps(routes, indent=2)}')
-        save_routes_to_yaml(server_id, routes)
-    return routes
 
-def save_routes_to_yaml(server_id, routes, output_dir='routes_backup'):
-    """ Сохраняет список маршрутов в YAML-файл. """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    routes = fetch_routes_stream(url, headers, verify=True, timeout=30)
+    if routes is None:
+        return None
 
-    filename = os.path.join(output_dir, f'server_{server_id}_routes.yml')
-    with open(filename, 'w') as file:
-        yaml.dump({'server_id': server_id, 'routes': routes}, file, default_flow_style=False, allow_unicode=True)
+    if verbose:
+        routes = print_routes(routes)
+    return save_routes_to_yaml(server_id, routes)
 
-    print(f"Routes saved to {filename}")
+def print_routes(routes):
+    for route in routes:
+        print(f"  {route['network']} (ID: {route['id']})")
+        yield route
+
+@traced(args=('server_id',))
+def save_routes_to_yaml(server_id, routes, output_dir='routes_backup'):
+    """ Сохраняет маршруты в YAML-файл по мере получения. """
+    filename = os.path.join(output_dir, f'server_{server_id}_routes.yml')
+    count = write_routes_yaml(server_id, routes, filename)
+    if count is not None:
+        print(f"{count} routes saved to {filename}")
+    return count
 
 def main():
+    parser = argparse.ArgumentParser(description='Save routes of every server to routes_backup')
+    parser.add_argument('--verbose', action='store_true', help='print every route while saving')
+    args = parser.parse_args()
+
     settings = load_settings()
     base_url = settings['base_url']
     api_token = settings['api_token']
@@ -71,7 +87,8 @@ def main():
     for item in settings['routes']:
         server_id = item['server_id']
         print(f"\nFetching routes for server: {server_id}")
-        get_server_routes(base_url, api_token, api_secret, server_id)
+        get_server_routes(base_url, api_token, api_secret, server_id, verbose=args.verbose)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)
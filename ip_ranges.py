@@ -0,0 +1,200 @@
+"""
+Загрузка диапазонов IP облачных провайдеров из локальных файлов.
+
+Каждый провайдер - генератор, который читает файл и выдает (prefix, attrs), где attrs
+содержит service, region, tag и change_number. Источники описываются в pritunl_settings.yml:
+
+ip_sources:
+  - provider: azure            # azure, aws, gcp, plain или module:function
+    file: ServiceTags_Public_20250203.json
+    filters:                   # любое из выражений; внутри выражения условия через запятую (И)
+      - tag=AzureDevOps
+      - service=AzureCloud,region=westeurope
+  - provider: plain
+    file: extra_routes.txt
+    optional: true             # отсутствующий или битый файл пропускается
+
+Значения фильтров поддерживают шаблоны fnmatch (например, region=eu-*).
+Источник, который не удалось прочитать, прерывает загрузку (load_sources возвращает None),
+иначе его префиксы считались бы устаревшими и удалялись с серверов. Исключение - optional: true.
+Независимые источники разбираются параллельно в отдельных процессах и объединяются
+в одно множество без дубликатов (первый источник в списке определяет provenance).
+"""
+import fnmatch
+import importlib
+import ipaddress
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+PROVIDERS = {}
+FILTER_KEYS = {'service', 'region', 'tag'}
+
+
+def register_provider(name):
+    """ Декоратор для регистрации провайдера по имени. """
+    def decorator(func):
+        PROVIDERS[name] = func
+        return func
+    return decorator
+
+
+@register_provider('azure')
+def iter_azure(filename):
+    """ ServiceTags_Public_*.json: values[].properties.addressPrefixes. """
+    with open(filename, 'r') as file:
+        data = json.load(file)
+
+    for entry in data.get('values', []):
+        properties = entry.get('properties', {})
+        name = entry.get('name') or entry.get('id') or ''
+        attrs = {
+            'tag': name,
+            # У региональных тегов (AzureCloud.westeurope) systemService пустой, сервис - часть имени до точки
+            'service': properties.get('systemService') or name.split('.', 1)[0],
+            'region': properties.get('region', ''),
+            'change_number': properties.get('changeNumber', data.get('changeNumber')),
+        }
+        for prefix in properties.get('addressPrefixes', []):
+            yield prefix, attrs
+
+
+@register_provider('aws')
+def iter_aws(filename):
+    """ AWS ip-ranges.json: prefixes[].ip_prefix и ipv6_prefixes[].ipv6_prefix. """
+    with open(filename, 'r') as file:
+        data = json.load(file)
+
+    for key, prefix_key in (('prefixes', 'ip_prefix'), ('ipv6_prefixes', 'ipv6_prefix')):
+        for entry in data.get(key, []):
+            yield entry[prefix_key], {
+                'tag': entry.get('service'),
+                'service': entry.get('service'),
+                'region': entry.get('region', ''),
+                'change_number': data.get('syncToken'),
+            }
+
+
+@register_provider('gcp')
+def iter_gcp(filename):
+    """ GCP cloud.json: prefixes[].ipv4Prefix / ipv6Prefix. """
+    with open(filename, 'r') as file:
+        data = json.load(file)
+
+    for entry in data.get('prefixes', []):
+        prefix = entry.get('ipv4Prefix') or entry.get('ipv6Prefix')
+        if prefix:
+            yield prefix, {
+                'tag': entry.get('service'),
+                'service': entry.get('service'),
+                'region': entry.get('scope', ''),
+                'change_number': data.get('syncToken'),
+            }
+
+
+@register_provider('plain')
+def iter_plain(filename):
+    """ Текстовый файл: одна подсеть на строку, строки с # пропускаются. """
+    tag = os.path.basename(filename)
+    with open(filename, 'r') as file:
+        for line in file:
+            prefix = line.strip()
+            if prefix and not prefix.startswith('#'):
+                yield prefix, {'tag': tag, 'service': '', 'region': '', 'change_number': None}
+
+
+def get_provider(name):
+    if name in PROVIDERS:
+        return PROVIDERS[name]
+    if ':' in name:
+        module_name, func_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    raise ValueError(f"Unknown IP range provider: {name}")
+
+
+def parse_filter(expression):
+    """ 'service=AzureCloud,region=westeurope' -> {'service': 'AzureCloud', 'region': 'westeurope'}. """
+    conditions = {}
+    for condition in expression.split(','):
+        key, sep, value = condition.partition('=')
+        key = key.strip()
+        if not sep or key not in FILTER_KEYS:
+            raise ValueError(f"Invalid filter condition: {condition!r} (expected service/region/tag=value)")
+        conditions[key] = value.strip()
+    return conditions
+
+
+def matches(attrs, filters):
+    if not filters:
+        return True
+    return any(
+        all(fnmatch.fnmatchcase(str(attrs.get(key) or ''), pattern) for key, pattern in conditions.items())
+        for conditions in filters
+    )
+
+
+def iter_source(source):
+    """ Потоково выдает (prefix, provenance) для одного источника с учетом фильтров. """
+    provider = source.get('provider', 'azure')
+    filename = source['file']
+    filters = [parse_filter(expression) for expression in source.get('filters', [])]
+
+    for prefix, attrs in get_provider(provider)(filename):
+        if not matches(attrs, filters):
+            continue
+        try:
+            ipaddress.ip_network(prefix, strict=False)
+        except ValueError:
+            print(f" Invalid network {prefix} in {filename}, skipping.")
+            continue
+        yield prefix, {'provider': provider, 'tag': attrs.get('tag'),
+                       'change_number': attrs.get('change_number'), 'file': filename}
+
+
+def parse_source(source):
+    """ Разбирает источник целиком (выполняется в рабочем процессе). Возвращает None, если источник не прочитан. """
+    filename = source.get('file')
+    if not filename or not os.path.exists(filename):
+        print(f" Source file {filename} not found!")
+        return None
+
+    try:
+        prefixes = {}
+        for prefix, provenance in iter_source(source):
+            prefixes.setdefault(prefix, provenance)
+        return list(prefixes.items())
+    except (OSError, ImportError, AttributeError, KeyError, ValueError) as e:
+        print(f" Failed to parse {filename}: {e}")
+        return None
+
+
+def load_sources(sources, workers=None):
+    """
+    Разбирает источники (параллельно, если их несколько) и возвращает {prefix: provenance}.
+    Возвращает None, если не прочитан хотя бы один источник без optional: true.
+    """
+    if len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=workers or min(len(sources), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(parse_source, sources))
+    else:
+        results = [parse_source(source) for source in sources]
+
+    desired = {}
+    failed = []
+    for source, prefixes in zip(sources, results):
+        label = f"{source.get('provider', 'azure')} {source.get('file')}"
+        if prefixes is None:
+            if not source.get('optional'):
+                failed.append(label)
+            print(f" {label}: {'skipped (optional)' if source.get('optional') else 'FAILED'}")
+            continue
+        for prefix, provenance in prefixes:
+            desired.setdefault(prefix, provenance)
+        print(f" {label}: {len(prefixes)} prefixes")
+
+    if failed:
+        print(f" Could not load sources: {', '.join(failed)}")
+        return None
+
+    print(f" Desired set: {len(desired)} unique prefixes from {len(sources)} sources")
+    return desired
@@ -0,0 +1,181 @@
+"""
+Нагрузочный тест скриптов на синтетическом парке серверов.
+
+Для каждой комбинации N (серверов) и M (маршрутов на сервер) генерирует парк через
+gen_synthetic_fleet.py, поднимает локальную заглушку API (pritunl_stub_api.py) и по очереди
+запускает сценарии discovery/add/delete/sync в отдельных процессах. Замеряет время,
+пиковый RSS процесса и число вызовов API. Результаты пишутся в CSV, графики строятся,
+если установлен matplotlib.
+
+Пример:
+  python3 load_test.py --servers 1,5,10 --routes 100,1000 --tag-prefixes 5000
+"""
+import argparse
+import contextlib
+import csv
+import importlib.util
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+import yaml
+
+from gen_synthetic_fleet import SETTINGS_FILE, write_fleet
+from pritunl_stub_api import start_stub_server
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = 'load_test_results'
+FLOWS = {
+    'discovery': ('get_all_server.py', []),
+    'add': ('add_route_azure.py', []),
+    'delete': ('delete_route.py', ['--live']),
+    'sync': ('update_config_saveroute.py', []),
+}
+METRICS = ['runtime_s', 'peak_rss_mb', 'api_calls']
+
+
+def run_flow_in_process(flow, workdir):
+    """ Выполняется в дочернем процессе: импортирует скрипт сценария и запускает его main(). """
+    script, argv = FLOWS[flow]
+    sys.path.insert(0, REPO_DIR)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(script)[0].replace('-', '_'),
+                                                  os.path.join(REPO_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if hasattr(module, 'CERT_PATH'):
+        # Клиентский сертификат не нужен для заглушки по http
+        module.CERT_PATH = None
+
+    os.chdir(workdir)
+    sys.argv = [script] + argv
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        module.main()
+    runtime = time.perf_counter() - started
+
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'runtime_s': runtime, 'peak_rss_mb': peak_rss_kb / 1024}))
+
+
+def run_flow(flow, workdir, base_url):
+    requests.post(f'{base_url}/__reset', timeout=10)
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-flow', flow, '--workdir', workdir],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"Flow {flow} failed:\n{proc.stderr}")
+        return None
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    stats = requests.get(f'{base_url}/__stats', timeout=10).json()
+    result['api_calls'] = sum(stats.values())
+    return result
+
+
+def run_case(servers, routes, args):
+    """ Генерирует парк N x M, поднимает заглушку и прогоняет выбранные сценарии. """
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='pritunl_load_') as workdir:
+        write_fleet(workdir, servers, routes, args.overlap, args.tag_prefixes, base_url='', seed=args.seed)
+        settings_path = os.path.join(workdir, SETTINGS_FILE)
+        with open(settings_path, 'r') as file:
+            settings = yaml.safe_load(file)
+
+        stub, _, base_url = start_stub_server(settings, latency=args.latency)
+        settings['base_url'] = base_url
+        with open(settings_path, 'w') as file:
+            yaml.dump(settings, file, default_flow_style=False, allow_unicode=True)
+
+        try:
+            for flow in args.flows:
+                result = run_flow(flow, workdir, base_url)
+                if result is None:
+                    continue
+                row = {'flow': flow, 'servers': servers, 'routes': routes, **result}
+                print(f"  {flow:<9} N={servers:<5} M={routes:<6} {result['runtime_s']:8.2f}s "
+                      f"{result['peak_rss_mb']:8.1f} MB {result['api_calls']:8} calls")
+                rows.append(row)
+        finally:
+            stub.shutdown()
+    return rows
+
+
+def save_csv(rows, filename):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['flow', 'servers', 'routes'] + METRICS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results saved to {filename}")
+
+
+def plot_results(rows, output_dir):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping plots.")
+        return
+
+    flows = sorted({row['flow'] for row in rows})
+    route_counts = sorted({row['routes'] for row in rows})
+    for metric in METRICS:
+        fig, axes = plt.subplots(1, len(flows), figsize=(4 * len(flows), 3.5), squeeze=False)
+        for ax, flow in zip(axes[0], flows):
+            for routes in route_counts:
+                points = sorted((row['servers'], row[metric]) for row in rows
+                                if row['flow'] == flow and row['routes'] == routes)
+                ax.plot([p[0] for p in points], [p[1] for p in points], marker='o', label=f'M={routes}')
+            ax.set_title(flow)
+            ax.set_xlabel('servers (N)')
+            ax.set_ylabel(metric)
+            ax.legend()
+        fig.tight_layout()
+        filename = os.path.join(output_dir, f'{metric}.png')
+        fig.savefig(filename)
+        plt.close(fig)
+        print(f"Plot saved to {filename}")
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling load test against a local Pritunl API stand-in')
+    parser.add_argument('--servers', type=parse_int_list, default=[1, 2, 4], help='comma-separated N values')
+    parser.add_argument('--routes', type=parse_int_list, default=[100, 500], help='comma-separated M values')
+    parser.add_argument('--overlap', type=float, default=0.2)
+    parser.add_argument('--tag-prefixes', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub API delay per request, seconds')
+    parser.add_argument('--flows', type=lambda value: value.split(','), default=list(FLOWS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default=RESULTS_DIR)
+    parser.add_argument('--run-flow', choices=list(FLOWS), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_flow:
+        run_flow_in_process(args.run_flow, args.workdir)
+        return
+
+    unknown = set(args.flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+
+    rows = []
+    for servers in args.servers:
+        for routes in args.routes:
+            print(f"\nFleet N={servers} M={routes}")
+            rows.extend(run_case(servers, routes, args))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    save_csv(rows, os.path.join(args.output_dir, 'results.csv'))
+    plot_results(rows, args.output_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Запись и воспроизведение HTTP-обмена с API Pritunl (кассеты).
+
+Включается переменной окружения PRITUNL_CASSETTE:
+  record:<файл.json> - реальные запросы выполняются и записываются вместе с временем ответа
+  replay:<файл.json> - ответы отдаются из файла без сети, с исходной задержкой
+
+PRITUNL_REPLAY_SCALE масштабирует задержку при воспроизведении (1 - как в записи, 0 - без задержки).
+Если для запроса нет записи с тем же телом, отдается запись того же пути с предупреждением;
+PRITUNL_REPLAY_STRICT=1 вместо этого завершает запрос ошибкой.
+Заголовки Auth-* при записи заменяются на REDACTED.
+
+Пример:
+  PRITUNL_CASSETTE=record:cassettes/delete.json python3 delete_route.py --live
+  PRITUNL_CASSETTE=replay:cassettes/delete.json PRITUNL_REPLAY_SCALE=0.5 python3 delete_route.py --live
+"""
+import atexit
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_ENV = 'PRITUNL_CASSETTE'
+SCALE_ENV = 'PRITUNL_REPLAY_SCALE'
+STRICT_ENV = 'PRITUNL_REPLAY_STRICT'
+REDACTED = 'REDACTED'
+
+
+def _request_path(url):
+    parts = urlsplit(url)
+    return f'{parts.path}?{parts.query}' if parts.query else parts.path
+
+
+def _body_key(data):
+    return json.dumps(data, sort_keys=True) if data is not None else ''
+
+
+def _redact_headers(headers):
+    return {key: (REDACTED if key.lower().startswith('auth-') else value) for key, value in (headers or {}).items()}
+
+
+class Recorder:
+    """ Выполняет реальные запросы и сохраняет пары запрос/ответ с временем выполнения. """
+
+    def __init__(self, filename, real_request):
+        self.filename = filename
+        self.real_request = real_request
+        self.interactions = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        interaction = {
+            'method': method.upper(),
+            'path': _request_path(url),
+            'request': {'headers': _redact_headers(kwargs.get('headers')), 'json': kwargs.get('json')},
+        }
+
+        started = time.perf_counter()
+        try:
+            response = self.real_request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            interaction['elapsed'] = time.perf_counter() - started
+            interaction['error'] = str(e)
+            self._append(interaction)
+            raise
+
+        interaction['response'] = {
+            'status': response.status_code,
+            'headers': {key: value for key, value in response.headers.items() if key.lower() == 'content-type'},
+            'body': response.text,
+        }
+        interaction['elapsed'] = time.perf_counter() - started
+        self._append(interaction)
+        return response
+
+    def _append(self, interaction):
+        with self.lock:
+            interaction['offset'] = len(self.interactions)
+            self.interactions.append(interaction)
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.filename, 'w') as file:
+            json.dump({
+                'version': 1,
+                'recorded_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'interactions': self.interactions,
+            }, file, indent=1, ensure_ascii=False)
+
+        print(f"Recorded {len(self.interactions)} requests to {self.filename}")
+
+
+class Replayer:
+    """ Отдает записанные ответы по методу, пути и телу запроса, в порядке записи. """
+
+    def __init__(self, filename, scale=1.0, strict=False):
+        with open(filename, 'r') as file:
+            data = json.load(file)
+
+        self.scale = scale
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.exact = collections.defaultdict(collections.deque)
+        self.by_path = collections.defaultdict(collections.deque)
+        self.last = {}
+        self.used = set()
+        for interaction in data.get('interactions', []):
+            body = _body_key(interaction['request'].get('json'))
+            self.exact[(interaction['method'], interaction['path'], body)].append(interaction)
+            self.by_path[(interaction['method'], interaction['path'])].append(interaction)
+
+    def _next(self, method, path, body):
+        exact_key = (method, path, body)
+        path_key = (method, path)
+        with self.lock:
+            for queue in (self.exact.get(exact_key), self.by_path.get(path_key)):
+                while queue:
+                    interaction = queue.popleft()
+                    if interaction['offset'] in self.used:
+                        continue
+                    self.used.add(interaction['offset'])
+                    self.last[path_key] = interaction
+                    return interaction
+            # Повторные опросы (например, статус сервера) получают последний записанный ответ
+            return self.last.get(path_key)
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        path = _request_path(url)
+        body = _body_key(kwargs.get('json'))
+        interaction = self._next(method, path, body)
+        if interaction is None:
+            raise requests.exceptions.ConnectionError(f'No recorded response for {method} {path}')
+        if _body_key(interaction['request'].get('json')) != body:
+            message = f"Recorded body differs for {method} {path}: sent {body}, recorded {_body_key(interaction['request'].get('json'))}"
+            if self.strict:
+                raise requests.exceptions.ConnectionError(message)
+            print(f"Warning: {message}")
+
+        if self.scale > 0:
+            time.sleep(interaction['elapsed'] * self.scale)
+
+        if 'error' in interaction:
+            raise requests.exceptions.ConnectionError(interaction['error'])
+
+        recorded = interaction['response']
+        response = requests.models.Response()
+        response.status_code = recorded['status']
+        response.headers = CaseInsensitiveDict(recorded.get('headers', {}))
+        response._content = recorded['body'].encode('utf-8')
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = url
+        response.elapsed = datetime.timedelta(seconds=interaction['elapsed'])
+        return response
+
+
+def install_cassette():
+    """ Подменяет requests.request согласно PRITUNL_CASSETTE. Без переменной ничего не делает. """
+    value = os.environ.get(CASSETTE_ENV)
+    if not value:
+        return None
+
+    mode, _, filename = value.partition(':')
+    if mode == 'record' and filename:
+        handler = Recorder(filename, requests.request)
+        atexit.register(handler.save)
+    elif mode == 'replay' and filename:
+        try:
+            scale = float(os.environ.get(SCALE_ENV, '1'))
+        except ValueError:
+            scale = -1
+        if scale < 0:
+            # Без воспроизведения скрипт пошел бы в реальный API, поэтому останавливаемся
+            raise SystemExit(f"Invalid {SCALE_ENV} value: {os.environ.get(SCALE_ENV)} (expected a number >= 0)")
+        handler = Replayer(filename, scale, os.environ.get(STRICT_ENV) == '1')
+        print(f"Replaying requests from {filename}")
+    else:
+        print(f"Invalid {CASSETTE_ENV} value: {value} (expected record:<file> or replay:<file>)")
+        return None
+
+    requests.request = handler.request
+    return handler
@@ -0,0 +1,308 @@
+"""
+Координация нескольких одновременно запущенных скриптов (например, из разных записей cron).
+
+- Advisory-блокировки (fcntl.flock) на сервер и на pritunl_settings.yml.
+- shared_fetch: если чтение для ключа уже выполняется другим процессом, ждем его и берем
+  результат; если результат моложе FRESHNESS секунд, API не вызывается вовсе.
+  Включается PRITUNL_FETCH_FRESHNESS > 0 (по умолчанию выключено: общий результат хранится
+  целиком в памяти и на диске, без него списки читаются потоково).
+- Очередь изменений: изменения маршрутов каждого задания записываются в очередь сервера.
+  Задание, которое держит блокировку сервера, применяет в одном цикле stop/start все
+  накопившиеся изменения, остальные задания сервер не останавливают. Записи заданий,
+  процесс которых завершился, и записи старше MUTATION_TTL секунд отбрасываются.
+  Применение каждой записи отмечается по ее id; ожидающее задание, чью запись не применили
+  (например, отбросили как устаревшую), применяет свое изменение само.
+- Сервер, замененный blue/green переключением, помечается выведенным (retire_server):
+  его очередь отклоняется, а новые изменения для него завершаются ServerRetired.
+
+Каталог состояния задается PRITUNL_COORD_DIR (по умолчанию .pritunl_coord).
+"""
+import fcntl
+import json
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+COORD_DIR = os.environ.get('PRITUNL_COORD_DIR', '.pritunl_coord')
+FRESHNESS = float(os.environ.get('PRITUNL_FETCH_FRESHNESS', '0'))
+MUTATION_WORKERS = 8
+MUTATION_TTL = float(os.environ.get('PRITUNL_MUTATION_TTL', '900'))
+
+
+class ServerRetired(Exception):
+    """ Сервер заменен другим (blue/green), изменения для него не применяются. """
+
+
+def _path(kind, name):
+    directory = os.path.join(COORD_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def atomic_write(filename, write):
+    """ Пишет файл через временный файл и os.replace, читатели не видят частичную запись. """
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            result = write(file)
+        os.replace(tmp_name, filename)
+        return result
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+@contextmanager
+def file_lock(name, blocking=True):
+    """ Эксклюзивная advisory-блокировка. При blocking=False отдает False, если блокировка занята. """
+    with open(_path('locks', f'{name}.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def server_lock(server_id, blocking=True):
+    return file_lock(f'server_{server_id}', blocking)
+
+
+def settings_lock():
+    """ Блокировка на чтение-изменение-запись pritunl_settings.yml. """
+    return file_lock('settings')
+
+
+def shared_fetch(key, fetch, freshness=FRESHNESS):
+    """ Возвращает свежий результат fetch() для key, общий для всех процессов. None не кешируется. """
+    cache_file = _path('cache', f'{key}.json')
+    with file_lock(f'fetch_{key}'):
+        if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < freshness:
+            with open(cache_file, 'r') as file:
+                print(f" Reusing {key} fetched {time.time() - os.path.getmtime(cache_file):.0f}s ago")
+                return json.load(file)
+
+        result = fetch()
+        if result is not None:
+            atomic_write(cache_file, lambda file: json.dump(result, file))
+        return result
+
+
+def invalidate(key):
+    with file_lock(f'fetch_{key}'):
+        try:
+            os.unlink(_path('cache', f'{key}.json'))
+        except FileNotFoundError:
+            pass
+
+
+def routes_key(server_id):
+    return f'server_{server_id}_routes'
+
+
+def enqueue_mutation(server_id, mutation, mutation_id=None):
+    """
+    mutation: {'job': ..., 'add': [network], 'delete': {network: route_id}}; добавляются id, pid и queued_at.
+    Прежние записи с тем же mutation_id заменяются. Возвращает id записи.
+    """
+    mutation = dict(mutation, id=mutation_id or uuid.uuid4().hex, pid=os.getpid(), queued_at=time.time())
+    queue_file = _path('queue', f'server_{server_id}.jsonl')
+    with file_lock(f'queue_{server_id}'):
+        if mutation_id and os.path.exists(queue_file):
+            with open(queue_file, 'r') as file:
+                lines = [line for line in file if line.strip() and json.loads(line).get('id') != mutation_id]
+            atomic_write(queue_file, lambda file: file.writelines(lines))
+        with open(queue_file, 'a') as file:
+            file.write(json.dumps(mutation) + '\n')
+    return mutation['id']
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_stale(mutation):
+    """ Задание завершилось, не дождавшись применения, или запись слишком старая (route_id могли устареть). """
+    if time.time() - mutation.get('queued_at', 0) > MUTATION_TTL:
+        return True
+    return not _process_alive(mutation.get('pid', 0))
+
+
+def drain_mutations(server_id):
+    """ Забирает очередь сервера целиком, отбрасывая устаревшие записи. """
+    queue_file = _path('queue', f'server_{server_id}.jsonl')
+    with file_lock(f'queue_{server_id}'):
+        if not os.path.exists(queue_file):
+            return []
+        with open(queue_file, 'r') as file:
+            mutations = [json.loads(line) for line in file if line.strip()]
+        os.unlink(queue_file)
+
+    fresh = []
+    for mutation in mutations:
+        if _is_stale(mutation):
+            print(f" Dropped stale changes of {mutation.get('job', '?')} (pid {mutation.get('pid')}) for {server_id}")
+        else:
+            fresh.append(mutation)
+    return fresh
+
+
+def _done_marker(mutation_id):
+    return _path('done', mutation_id)
+
+
+def _mark_done(mutations):
+    """ Отмечает записи примененными для заданий, которые ждут блокировку; старые отметки удаляются. """
+    for mutation in mutations:
+        if mutation.get('id'):
+            atomic_write(_done_marker(mutation['id']), lambda file: json.dump({'job': mutation.get('job')}, file))
+
+    directory = os.path.dirname(_done_marker('_'))
+    for name in os.listdir(directory):
+        try:
+            if time.time() - os.path.getmtime(os.path.join(directory, name)) > MUTATION_TTL:
+                os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def _take_done(mutation_id):
+    """ True, если запись mutation_id применило другое задание (отметка при этом удаляется). """
+    try:
+        os.unlink(_done_marker(mutation_id))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _retired_marker(server_id):
+    return _path('retired', f'server_{server_id}.json')
+
+
+def retired_to(server_id):
+    """ ID сервера, которым заменен server_id, или None. """
+    try:
+        with open(_retired_marker(server_id), 'r') as file:
+            return json.load(file)['replacement']
+    except FileNotFoundError:
+        return None
+
+
+def retire_server(server_id, replacement):
+    """
+    Помечает server_id замененным на replacement (вызывается под блокировкой server_id) и
+    отклоняет его очередь: route_id в ней относятся к старому серверу. Пометка с replacement
+    снимается, так что откат на прежний сервер снова разрешает его изменять.
+    """
+    atomic_write(_retired_marker(server_id), lambda file: json.dump({'replacement': replacement}, file))
+    try:
+        os.unlink(_retired_marker(replacement))
+    except FileNotFoundError:
+        pass
+
+    _reject_queue(server_id, replacement)
+
+
+def _reject_queue(server_id, replacement):
+    for mutation in drain_mutations(server_id):
+        print(f" Rejected changes of {mutation.get('job', '?')} for {server_id}: "
+              f"server replaced by {replacement}, rerun the job")
+
+
+class MutationWindow:
+    """ Держатель блокировки сервера применяет изменения всех заданий из очереди. """
+
+    def __init__(self, server_id, mutation_id=None):
+        self.server_id = server_id
+        self.mutation_id = mutation_id
+        self.added = set()
+        self.deleted = set()
+
+    def apply(self, request):
+        """
+        Применяет очередь, пока она не опустеет (сервер должен быть остановлен).
+        request(method, path, data=None) выполняет подписанный запрос и возвращает None при ошибке.
+        """
+        while True:
+            mutations = drain_mutations(self.server_id)
+            if not mutations:
+                break
+
+            adds = {network for mutation in mutations for network in mutation.get('add', [])}
+            deletes = {}
+            for mutation in mutations:
+                deletes.update(mutation.get('delete', {}))
+            jobs = sorted({mutation.get('job', '?') for mutation in mutations})
+            print(f" Applying {len(adds)} adds and {len(deletes)} deletes on {self.server_id} from: {', '.join(jobs)}")
+
+            with ThreadPoolExecutor(max_workers=MUTATION_WORKERS) as executor:
+                deleted = executor.map(
+                    lambda item: (item[0], request('DELETE', f'/server/{self.server_id}/route/{item[1]}') is not None),
+                    deletes.items())
+                added = executor.map(
+                    lambda network: (network, request('POST', f'/server/{self.server_id}/route', {'network': network}) is not None),
+                    sorted(adds - set(deletes)))
+                for network, ok in deleted:
+                    if ok:
+                        self.deleted.add(network)
+                        print(f" Deleted route {network} from server {self.server_id}")
+                    else:
+                        print(f" Failed to delete route {network} from server {self.server_id}")
+                for network, ok in added:
+                    if ok:
+                        self.added.add(network)
+                        print(f" Added route {network} to server {self.server_id}")
+                    else:
+                        print(f" Failed to add route {network} to server {self.server_id}")
+            _mark_done(mutation for mutation in mutations if mutation.get('id') != self.mutation_id)
+
+        invalidate(routes_key(self.server_id))
+        return self.added, self.deleted
+
+
+def _check_retired(server_id):
+    replacement = retired_to(server_id)
+    if replacement:
+        # Записи, попавшие в очередь после переключения, тоже не применяются
+        _reject_queue(server_id, replacement)
+        raise ServerRetired(f"Server {server_id} was replaced by {replacement}, changes rejected")
+
+
+@contextmanager
+def mutation_window(server_id, mutation):
+    """
+    Ставит изменение задания в очередь сервера. Отдает MutationWindow, если это задание
+    держит сервер и должно выполнить stop/apply/start, или None, если запись этого задания
+    применило задание, которое держало сервер. Для выведенного сервера - ServerRetired.
+    """
+    _check_retired(server_id)
+    mutation_id = enqueue_mutation(server_id, mutation)
+    with server_lock(server_id, blocking=False) as acquired:
+        if acquired:
+            _check_retired(server_id)
+            yield MutationWindow(server_id, mutation_id)
+            return
+    print(f" Server {server_id} is busy, {mutation.get('job')} changes queued for the running job")
+    # Ждем окончания чужого окна. Если нашу запись не применили (пришла после последней
+    # выборки очереди или отброшена как устаревшая), ставим ее заново и применяем сами
+    with server_lock(server_id):
+        _check_retired(server_id)
+        if not _take_done(mutation_id):
+            enqueue_mutation(server_id, mutation, mutation_id)
+            yield MutationWindow(server_id, mutation_id)
+            return
+    yield None
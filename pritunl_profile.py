@@ -0,0 +1,162 @@
+"""
+Профилирование и трассировка скриптов.
+
+Включается переменной окружения PRITUNL_PROFILE (режимы через запятую):
+  cprofile - cProfile всего main(), результат в .prof и текстовый отчет
+  sample   - сэмплирующий профайлер, стеки в формате collapsed (flamegraph/speedscope)
+  trace    - спаны вызовов API и фаз в формате Chrome trace (chrome://tracing, Perfetto)
+
+Пример:
+  PRITUNL_PROFILE=trace,cprofile python3 delete_route.py --live
+"""
+import cProfile
+import collections
+import functools
+import inspect
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = 'PRITUNL_PROFILE'
+PROFILE_DIR = os.environ.get('PRITUNL_PROFILE_DIR', 'profiles')
+PROFILE_MODES = {'cprofile', 'sample', 'trace'}
+SAMPLE_INTERVAL = 0.005
+
+_modes = {mode.strip() for mode in os.environ.get(PROFILE_ENV, '').split(',') if mode.strip()}
+_events = []
+_events_lock = threading.Lock()
+
+
+@contextmanager
+def span(name, **args):
+    """ Записывает интервал выполнения блока как событие Chrome trace. """
+    if 'trace' not in _modes:
+        yield
+        return
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': (end - start) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        with _events_lock:
+            _events.append(event)
+
+
+def traced(name=None, args=()):
+    """ Декоратор: оборачивает вызов функции в span. args - имена параметров для записи в спан. """
+    def decorator(func):
+        label = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*call_args, **call_kwargs):
+            if 'trace' not in _modes:
+                return func(*call_args, **call_kwargs)
+
+            span_args = {}
+            if args:
+                bound = signature.bind_partial(*call_args, **call_kwargs).arguments
+                span_args = {key: bound[key] for key in args if key in bound}
+            with span(label, **span_args):
+                return func(*call_args, **call_kwargs)
+
+        return wrapper
+    return decorator
+
+
+class _Sampler(threading.Thread):
+    """
+    Периодически снимает стеки всех потоков (кроме самого сэмплера) и считает одинаковые стеки.
+    Корень каждого стека - имя потока, так что работа пулов потоков видна отдельно от main.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                if stack:
+                    stack.append(names.get(ident, f'thread-{ident}'))
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _write_trace(filename):
+    with _events_lock:
+        events = list(_events)
+    events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                   'tid': threading.main_thread().ident, 'args': {'name': 'main'}})
+    with open(filename, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+    print(f"Trace saved to {filename} ({len(events) - 1} spans)")
+
+
+def profile_main(main):
+    """ Запускает main() с профилированием согласно PRITUNL_PROFILE. """
+    if not _modes:
+        return main()
+
+    unknown = _modes - PROFILE_MODES
+    if unknown:
+        print(f"Unknown {PROFILE_ENV} modes ignored: {', '.join(sorted(unknown))}")
+
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'script'
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{script}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    profiler = cProfile.Profile() if 'cprofile' in _modes else None
+    sampler = _Sampler() if 'sample' in _modes else None
+
+    if sampler:
+        sampler.start()
+    try:
+        with span(script):
+            if profiler:
+                return profiler.runcall(main)
+            return main()
+    finally:
+        if sampler:
+            sampler.stop()
+            with open(f'{prefix}.collapsed', 'w') as file:
+                for stack, count in sampler.stacks.most_common():
+                    file.write(f'{stack} {count}\n')
+            print(f"Samples saved to {prefix}.collapsed")
+
+        if profiler:
+            profiler.dump_stats(f'{prefix}.prof')
+            with open(f'{prefix}.txt', 'w') as file:
+                pstats.Stats(profiler, stream=file).sort_stats('cumulative').print_stats(50)
+            print(f"Profile saved to {prefix}.prof")
+
+        if 'trace' in _modes:
+            _write_trace(f'{prefix}.trace.json')
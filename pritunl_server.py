@@ -0,0 +1,97 @@
+"""
+Остановка и запуск сервера Pritunl с ожиданием готовности (общий код скриптов).
+
+Функции принимают request(method, path, data=None) - подписанный запрос скрипта
+(signed_request с подставленными base_url и ключами), который возвращает разобранный
+JSON ответа или None при ошибке.
+"""
+import time
+
+from pritunl_profile import traced
+
+START_TIMEOUT = 60
+START_RETRIES = 1
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 5
+
+# Итог manage_server в скриптах маршрутов - пара (статус, значение)
+READY = 'ready'          # значение - время до готовности после перезапуска, секунды
+UNCHANGED = 'unchanged'  # изменений нет, сервер не останавливался
+SKIPPED = 'skipped'      # значение - причина; сервер не трогали
+FAILED = 'failed'        # сервер не запустился, следующие серверы не обрабатываются
+
+
+def get_server_status(request, server_id):
+    """ Возвращает текущий статус сервера (online/offline). """
+    server = request('GET', f'/server/{server_id}')
+    if server:
+        return server.get('status')
+    return None
+
+
+def wait_for_server_online(request, server_id, timeout=START_TIMEOUT):
+    """ Опрашивает сервер с нарастающей задержкой, пока он не перейдет в online. """
+    deadline = time.monotonic() + timeout
+    delay = POLL_INITIAL_DELAY
+
+    while True:
+        if get_server_status(request, server_id) == 'online':
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+
+def stop_server(request, server_id):
+    stop_response = request('PUT', f'/server/{server_id}/operation/stop')
+    print(f'Server stop response: {stop_response}')
+    return stop_response is not None
+
+
+@traced(args=('server_id',))
+def start_server(request, server_id):
+    """ Запускает сервер и ждет online. Возвращает время до готовности в секундах или None. """
+    started_at = time.monotonic()
+
+    for attempt in range(START_RETRIES + 1):
+        start_response = request('PUT', f'/server/{server_id}/operation/start')
+        print(f'Server start response: {start_response}')
+
+        if wait_for_server_online(request, server_id):
+            time_to_ready = time.monotonic() - started_at
+            print(f'Server {server_id} is online after {time_to_ready:.1f}s')
+            return time_to_ready
+
+        print(f'Server {server_id} is not online after {START_TIMEOUT}s (attempt {attempt + 1}/{START_RETRIES + 1})')
+
+    print(f'Server {server_id} failed to start')
+    return None
+
+
+def start_result(time_to_ready):
+    """ Итог manage_server по результату start_server. """
+    if time_to_ready is None:
+        return FAILED, None
+    return READY, time_to_ready
+
+
+def print_rollout_summary(results):
+    """ Печатает итог обхода серверов. results: {server_id: (статус, значение)} в порядке обработки. """
+    print("\nTime to ready:")
+    for server_id, (status, value) in results.items():
+        if status == READY:
+            print(f"  {server_id}: {value:.1f}s")
+        elif status == UNCHANGED:
+            print(f"  {server_id}: unchanged, not restarted")
+        elif status == FAILED:
+            print(f"  {server_id}: did not come back online")
+
+    skipped = {server_id: value for server_id, (status, value) in results.items() if status == SKIPPED}
+    if skipped:
+        print("\nSkipped:")
+        for server_id, reason in skipped.items():
+            print(f"  {server_id}: {reason}")
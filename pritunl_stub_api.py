@@ -0,0 +1,216 @@
+"""
+Локальная заглушка API Pritunl для нагрузочных тестов.
+
+Поднимает HTTP-сервер с эндпоинтами серверов (включая создание и удаление), маршрутов, организаций и хостов, начальное состояние берется
+из pritunl_settings.yml (servers и routes). Подпись запросов не проверяется.
+GET /__stats возвращает число вызовов по эндпоинтам, POST /__reset обнуляет счетчики.
+"""
+import argparse
+import collections
+import json
+import re
+import threading
+import time
+import uuid
+import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SETTINGS_FILE = 'pritunl_settings.yml'
+
+
+class StubState:
+    """ Состояние заглушки: серверы, маршруты, организации, хосты и счетчики вызовов. """
+
+    def __init__(self, settings, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.servers = {}
+        self.routes = {}
+        self.organizations = {}
+        self.hosts = {}
+
+        for index, server in enumerate(settings.get('servers', [])):
+            self.servers[server['id']] = dict(server, status='online')
+            self.routes.setdefault(server['id'], {})
+            self.organizations[server['id']] = {f'c{index + 1:023x}'}
+            self.hosts[server['id']] = {'b' * 24}
+        for item in settings.get('routes', []):
+            server_id = item['server_id']
+            self.servers.setdefault(server_id, {'id': server_id, 'name': server_id, 'status': 'online'})
+            self.organizations.setdefault(server_id, set())
+            self.hosts.setdefault(server_id, set())
+            server_routes = self.routes.setdefault(server_id, {})
+            for network in item.get('network', []):
+                server_routes[uuid.uuid4().hex] = network
+
+    def route_list(self, server_id):
+        return [{'id': route_id, 'server': server_id, 'network': network}
+                for route_id, network in self.routes[server_id].items()]
+
+    def create_server(self, config):
+        """ Создает сервер в состоянии offline с маршрутом по умолчанию, как Pritunl. """
+        for server in self.servers.values():
+            if config.get('network') and server.get('network') == config['network']:
+                return 400, {'error': 'network_in_use'}
+            if config.get('port') and server.get('port') == config['port']:
+                return 400, {'error': 'port_in_use'}
+
+        server_id = uuid.uuid4().hex[:24]
+        self.servers[server_id] = dict(config, id=server_id, status='offline')
+        self.routes[server_id] = {uuid.uuid4().hex: '0.0.0.0/0'}
+        self.organizations[server_id] = set()
+        self.hosts[server_id] = set()
+        return 200, self.servers[server_id]
+
+    def delete_server(self, server_id):
+        for items in (self.servers, self.routes, self.organizations, self.hosts):
+            items.pop(server_id, None)
+        return 200, {}
+
+    def attachments(self, kind, server_id, item_id, method):
+        """ Подключение/отключение организаций и хостов; организации меняются только на остановленном сервере. """
+        items = self.organizations if kind == 'organization' else self.hosts
+        if kind == 'organization' and self.servers[server_id]['status'] == 'online':
+            return 400, {'error': 'server_not_offline'}
+        if method == 'PUT':
+            items[server_id].add(item_id)
+        elif method == 'DELETE':
+            items[server_id].discard(item_id)
+        return 200, {}
+
+
+def _endpoint(method, path):
+    """ Нормализует путь для статистики: /server/<id>/route/<id> -> /server/{id}/route/{id}. """
+    return f"{method} {re.sub(r'/[0-9a-f]{24,32}', '/{id}', path)}"
+
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length)) if length else None
+
+        def _dispatch(self, method):
+            path = self.path.split('?', 1)[0]
+            if path == '/__stats':
+                with state.lock:
+                    return self._send(dict(state.calls))
+            if path == '/__reset':
+                with state.lock:
+                    state.calls.clear()
+                return self._send({})
+
+            with state.lock:
+                state.calls[_endpoint(method, path)] += 1
+            if state.latency:
+                time.sleep(state.latency)
+
+            data = self._read_json()
+            with state.lock:
+                status, payload = self._handle(method, path, data)
+            self._send(payload, status)
+
+        def _handle(self, method, path, data):
+            if method == 'GET' and path == '/server':
+                return 200, list(state.servers.values())
+            if method == 'POST' and path == '/server':
+                return state.create_server(data or {})
+
+            match = re.fullmatch(r'/server/([^/]+)(/.*)?', path)
+            if not match or match.group(1) not in state.servers:
+                return 404, {'error': 'not found'}
+            server_id, rest = match.group(1), match.group(2) or ''
+            server = state.servers[server_id]
+
+            if method == 'GET' and rest == '':
+                return 200, server
+            if method == 'DELETE' and rest == '':
+                return state.delete_server(server_id)
+            if method == 'GET' and rest == '/route':
+                return 200, state.route_list(server_id)
+            if method == 'POST' and rest == '/route':
+                route_id = uuid.uuid4().hex
+                state.routes[server_id][route_id] = data['network']
+                return 200, {'id': route_id, 'server': server_id, 'network': data['network']}
+
+            operation = re.fullmatch(r'/operation/(start|stop)', rest)
+            if method == 'PUT' and operation:
+                server['status'] = 'online' if operation.group(1) == 'start' else 'offline'
+                return 200, server
+
+            listing = re.fullmatch(r'/(organization|host)', rest)
+            if method == 'GET' and listing:
+                items = state.organizations if listing.group(1) == 'organization' else state.hosts
+                return 200, [{'id': item_id, 'server': server_id} for item_id in sorted(items[server_id])]
+
+            attachment = re.fullmatch(r'/(organization|host)/([^/]+)', rest)
+            if method in ('PUT', 'DELETE') and attachment:
+                return state.attachments(attachment.group(1), server_id, attachment.group(2), method)
+
+            route = re.fullmatch(r'/route/([^/]+)', rest)
+            if method == 'DELETE' and route:
+                if state.routes[server_id].pop(route.group(1), None) is None:
+                    return 404, {'error': 'route not found'}
+                return 200, {}
+
+            return 404, {'error': 'not found'}
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def do_PUT(self):
+            self._dispatch('PUT')
+
+        def do_DELETE(self):
+            self._dispatch('DELETE')
+
+    return StubHandler
+
+
+def start_stub_server(settings, host='127.0.0.1', port=0, latency=0.0):
+    """ Запускает заглушку в фоновом потоке. Возвращает (server, state, base_url). """
+    state = StubState(settings, latency)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Pritunl API')
+    parser.add_argument('--settings', default=SETTINGS_FILE)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency', type=float, default=0.0, help='artificial delay per request, seconds')
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = yaml.safe_load(file)
+
+    server, state, base_url = start_stub_server(settings, args.host, args.port, args.latency)
+    print(f"Stub Pritunl API on {base_url} with {len(state.servers)} servers")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Потоковое чтение списка маршрутов GET /server/{id}/route.
+
+Ответ читается частями и разбирается по одному объекту, из каждого маршрута остаются
+только нужные поля (по умолчанию id и network). Полный список в памяти не собирается,
+маршруты можно сразу складывать в индекс или писать в снимок YAML.
+
+Ошибки разбора и соединения во время чтения выдаются как RouteStreamError уже в цикле
+вызывающего кода, поэтому все потребители потока ее перехватывают.
+"""
+import codecs
+import json
+from contextlib import ExitStack
+
+import requests
+
+from pritunl_coord import FRESHNESS, atomic_write, routes_key, shared_fetch
+from pritunl_profile import span
+
+ROUTE_FIELDS = ('id', 'network')
+CHUNK_SIZE = 64 * 1024
+
+
+class RouteStreamError(Exception):
+    """ Список маршрутов оборвался или пришел не в формате JSON-массива. """
+
+
+def iter_json_array(chunks):
+    """ Инкрементально разбирает JSON-массив верхнего уровня из текстовых частей и выдает его элементы. """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+
+    for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError(f"Expected JSON array, got {buffer[pos]!r}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Объект пришел не полностью, ждем следующую часть
+                break
+            pos = end
+            yield item
+
+    if not started:
+        raise ValueError("Empty response, expected JSON array")
+    raise ValueError("Truncated JSON array")
+
+
+def iter_routes(response, fields=ROUTE_FIELDS):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = (decoder.decode(chunk) for chunk in response.iter_content(CHUNK_SIZE))
+    for route in iter_json_array(chunks):
+        yield route if fields is None else {key: route.get(key) for key in fields}
+
+
+def fetch_routes_stream(url, headers, fields=ROUTE_FIELDS, **request_kwargs):
+    """
+    Выполняет GET со stream=True. Возвращает генератор маршрутов (fields=None - целиком) или None при ошибке.
+    Спан http охватывает и запрос, и чтение ответа.
+    """
+    stack = ExitStack()
+    stack.enter_context(span('http', method='GET', url=url))
+    try:
+        response = requests.request('GET', url, headers=headers, stream=True, **request_kwargs)
+    except requests.exceptions.RequestException as e:
+        stack.close()
+        print(f"Request failed: {e}")
+        return None
+
+    if response.status_code != 200:
+        stack.close()
+        print(f'Error: {response.status_code}, Message: {response.text}')
+        return None
+    return _consume(response, fields, stack)
+
+
+def _consume(response, fields, stack):
+    try:
+        yield from iter_routes(response, fields)
+    except (ValueError, requests.exceptions.RequestException) as e:
+        raise RouteStreamError(f"Route listing from {response.url} failed: {e}") from e
+    finally:
+        response.close()
+        stack.close()
+
+
+def fetch_routes_shared(server_id, url, headers, **request_kwargs):
+    """
+    Маршруты {id, network}, общие для одновременно запущенных заданий (pritunl_coord.shared_fetch).
+    Общий результат хранится списком, поэтому без PRITUNL_FETCH_FRESHNESS > 0 возвращается
+    обычный поток fetch_routes_stream (RouteStreamError - в цикле вызывающего кода).
+    """
+    if FRESHNESS <= 0:
+        return fetch_routes_stream(url, headers, **request_kwargs)
+
+    def fetch():
+        routes = fetch_routes_stream(url, headers, **request_kwargs)
+        if routes is None:
+            return None
+        try:
+            return list(routes)
+        except RouteStreamError as e:
+            print(e)
+            return None
+
+    return shared_fetch(routes_key(server_id), fetch)
+
+
+def write_routes_yaml(server_id, routes, filename):
+    """
+    Потоково пишет снимок {server_id, routes} в YAML. Возвращает число записанных маршрутов
+    или None, если поток оборвался; прежний снимок при этом не меняется.
+    """
+    try:
+        return atomic_write(filename, lambda file: _write_routes(file, server_id, routes))
+    except RouteStreamError as e:
+        print(f"{e}; {filename} left unchanged")
+        return None
+
+
+def _write_routes(file, server_id, routes):
+    count = 0
+    for route in routes:
+        if count == 0:
+            file.write('routes:\n')
+        # Строки JSON - корректные скаляры YAML в двойных кавычках
+        for index, (key, value) in enumerate(route.items()):
+            file.write(f"{'- ' if index == 0 else '  '}{key}: {json.dumps(value, ensure_ascii=False)}\n")
+        count += 1
+    if count == 0:
+        file.write('routes: []\n')
+    file.write(f'server_id: {json.dumps(server_id)}\n')
+    return count
@@ -0,0 +1,73 @@
+"""
+Тесты add_route_azure.py и add_routes_to_txt.py: сервер не трогается, если список маршрутов не получен.
+"""
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import add_route_azure
+import add_routes_to_txt
+import pritunl_coord
+
+SERVER_ID = 'a' * 24
+
+
+def fake_response(body, status=200):
+    response = requests.models.Response()
+    response.status_code = status
+    response._content = body.encode('utf-8')
+    response._content_consumed = True
+    response.url = 'http://stub/server/1/route'
+    return response
+
+
+@pytest.fixture(autouse=True)
+def coord_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pritunl_coord, 'COORD_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def listing(monkeypatch):
+    """ Отдает body на запрос списка маршрутов и записывает остальные запросы. """
+    requests_sent = []
+
+    def install(body, status=200):
+        def request(method, url, *args, **kwargs):
+            if method == 'GET' and url.endswith('/route'):
+                return fake_response(body, status)
+            requests_sent.append((method, url))
+            return fake_response('{}')
+        monkeypatch.setattr(requests, 'request', request)
+        return requests_sent
+    return install
+
+
+def manage(module):
+    if module is add_route_azure:
+        return module.manage_server('http://stub', 't', 's', SERVER_ID, 'test', {'10.0.1.0/24': {}})
+    return module.manage_server('http://stub', 't', 's', SERVER_ID, {'10.0.1.0/24'})
+
+
+@pytest.mark.parametrize('module', [add_route_azure, add_routes_to_txt])
+@pytest.mark.parametrize('body, status', [
+    ('{"error": "unavailable"}', 503),
+    ('[{"id": "1", "network": "10.0.0.0/24"}, {"id"', 200),
+])
+def test_failed_listing_skips_server(listing, module, body, status):
+    requests_sent = listing(body, status)
+
+    assert manage(module) == (module.SKIPPED, 'route listing failed')
+    assert requests_sent == []
+
+
+@pytest.mark.parametrize('module', [add_route_azure, add_routes_to_txt])
+def test_existing_routes_are_not_added_again(listing, module):
+    requests_sent = listing('[{"id": "1", "network": "10.0.1.0/24"}]')
+
+    assert manage(module) == (module.UNCHANGED, None)
+    assert requests_sent == []
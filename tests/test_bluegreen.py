@@ -0,0 +1,137 @@
+"""
+Тесты bluegreen_rollout.py на заглушке API: deploy, rollback, cleanup и отмена неудачного переключения.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bluegreen_rollout as bg
+import pritunl_coord
+from pritunl_stub_api import start_stub_server
+
+SERVER_ID = 'a' * 24
+STANDBY_NETWORK = '10.200.0.0/24'
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pritunl_coord, 'COORD_DIR', str(tmp_path / 'coord'))
+    monkeypatch.setattr(bg, 'CERT_PATH', None)
+
+    settings = {
+        'api_token': 't',
+        'api_secret': 's',
+        'servers': [{'id': SERVER_ID, 'name': 'vpn', 'port': 1194, 'network': '10.100.0.0/24'}],
+        'routes': [{'server_id': SERVER_ID,
+                    'network': ['10.0.0.0/24', '10.0.1.0/24', '20.0.0.0/24', '192.168.0.0/24']}],
+    }
+    server, state, base_url = start_stub_server(settings)
+    settings['base_url'] = base_url
+    bg.save_settings(settings)
+    yield state, (base_url, 't', 's'), settings
+    server.shutdown()
+
+
+def networks(state, server_id):
+    return set(state.routes[server_id].values())
+
+
+def deploy(api, settings, with_sources=False):
+    return bg.deploy(api, settings, SERVER_ID, None, STANDBY_NETWORK, with_sources)
+
+
+def test_deploy_switches_to_standby_and_keeps_source_prefixes(stub, tmp_path):
+    state, api, settings = stub
+    organizations = set(state.organizations[SERVER_ID])
+    # routes_to_delete.txt от add-routeAZ_to_del.py: все маршруты из источников, 20.0.0.0/24 в них больше нет
+    (tmp_path / 'routes_to_delete.txt').write_text('10.0.1.0/24\n20.0.0.0/24\n')
+    (tmp_path / 'sources.txt').write_text('10.0.1.0/24\n20.0.5.0/24\n')
+    settings['ip_sources'] = [{'provider': 'plain', 'file': 'sources.txt'}]
+
+    assert deploy(api, settings, with_sources=True) is not None
+
+    new_id = bg.load_settings()['servers'][0]['id']
+    assert new_id != SERVER_ID
+    assert networks(state, new_id) == {'10.0.0.0/24', '10.0.1.0/24', '20.0.5.0/24', '192.168.0.0/24'}
+    assert state.servers[SERVER_ID]['status'] == 'offline'
+    assert state.servers[new_id]['status'] == 'online'
+    assert state.organizations[new_id] == organizations
+    assert state.organizations[SERVER_ID] == set()
+    assert bg.load_state()[new_id]['previous'] == SERVER_ID
+    assert pritunl_coord.retired_to(SERVER_ID) == new_id
+
+
+def test_deploy_without_sources_drops_routes_to_delete(stub, tmp_path):
+    state, api, settings = stub
+    (tmp_path / 'routes_to_delete.txt').write_text('10.0.1.0/24\n20.0.0.0/24\n')
+
+    assert deploy(api, settings) is not None
+
+    new_id = bg.load_settings()['servers'][0]['id']
+    assert networks(state, new_id) == {'10.0.0.0/24', '192.168.0.0/24'}
+
+
+def test_rollback_restores_previous_server(stub):
+    state, api, settings = stub
+    organizations = set(state.organizations[SERVER_ID])
+    previous_routes = networks(state, SERVER_ID)
+    deploy(api, settings)
+    new_id = bg.load_settings()['servers'][0]['id']
+
+    assert bg.rollback(api, settings, new_id) is not None
+
+    assert state.servers[SERVER_ID]['status'] == 'online'
+    assert state.organizations[SERVER_ID] == organizations
+    assert new_id not in state.servers
+    assert bg.load_state() == {}
+    restored = bg.load_settings()
+    assert restored['servers'][0]['id'] == SERVER_ID
+    assert set(restored['routes'][0]['network']) == previous_routes
+
+
+def test_cleanup_deletes_retired_server(stub):
+    state, api, settings = stub
+    deploy(api, settings)
+    new_id = bg.load_settings()['servers'][0]['id']
+
+    assert bg.cleanup(api, new_id)['id'] == SERVER_ID
+
+    assert SERVER_ID not in state.servers
+    assert bg.load_state() == {}
+    assert bg.cleanup(api, new_id) == {}
+
+
+def fail_attach(state, monkeypatch):
+    attachments = state.attachments
+
+    def failing(kind, server_id, item_id, method):
+        if kind == 'organization' and method == 'PUT' and server_id != SERVER_ID:
+            return 400, {'error': 'attach failed'}
+        return attachments(kind, server_id, item_id, method)
+    monkeypatch.setattr(state, 'attachments', failing)
+
+
+def fail_start(state, monkeypatch):
+    start_server = bg.start_server
+    monkeypatch.setattr(bg, 'start_server',
+                        lambda request, server_id: start_server(request, server_id) if server_id == SERVER_ID else None)
+
+
+@pytest.mark.parametrize('failure', [fail_attach, fail_start])
+def test_failed_switch_is_reverted(stub, monkeypatch, failure):
+    state, api, settings = stub
+    organizations = set(state.organizations[SERVER_ID])
+    failure(state, monkeypatch)
+
+    assert deploy(api, settings) is None
+
+    assert list(state.servers) == [SERVER_ID]
+    assert state.servers[SERVER_ID]['status'] == 'online'
+    assert state.organizations[SERVER_ID] == organizations
+    assert bg.load_settings()['servers'][0]['id'] == SERVER_ID
+    assert bg.load_state() == {}
+    assert pritunl_coord.retired_to(SERVER_ID) is None
@@ -0,0 +1,56 @@
+"""
+Тесты загрузки источников ip_ranges.py: фильтры и обработка нечитаемых источников.
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ip_ranges
+
+
+def write_service_tags(path):
+    path.write_text(json.dumps({'changeNumber': 7, 'values': [
+        {'name': 'AzureCloud.westeurope',
+         'properties': {'systemService': '', 'region': 'westeurope', 'addressPrefixes': ['20.0.0.0/24']}},
+        {'name': 'AzureDevOps',
+         'properties': {'systemService': 'AzureDevOps', 'region': '', 'addressPrefixes': ['20.0.1.0/24']}},
+    ]}))
+    return str(path)
+
+
+def test_regional_azure_tag_matches_service_filter(tmp_path):
+    filename = write_service_tags(tmp_path / 'tags.json')
+
+    desired = ip_ranges.load_sources([
+        {'provider': 'azure', 'file': filename, 'filters': ['service=AzureCloud,region=westeurope']}])
+
+    assert set(desired) == {'20.0.0.0/24'}
+
+
+def test_missing_source_aborts_load(tmp_path):
+    present = tmp_path / 'a.txt'
+    present.write_text('30.0.0.0/24\n')
+
+    desired = ip_ranges.load_sources([{'provider': 'plain', 'file': str(present)},
+                                      {'provider': 'plain', 'file': str(tmp_path / 'b.txt')}])
+
+    assert desired is None
+
+
+def test_unknown_provider_aborts_load(tmp_path):
+    present = tmp_path / 'a.txt'
+    present.write_text('30.0.0.0/24\n')
+
+    assert ip_ranges.load_sources([{'provider': 'nope', 'file': str(present)}]) is None
+
+
+def test_optional_source_is_skipped(tmp_path):
+    present = tmp_path / 'a.txt'
+    present.write_text('30.0.0.0/24\n# comment\n')
+
+    desired = ip_ranges.load_sources([{'provider': 'plain', 'file': str(present)},
+                                      {'provider': 'plain', 'file': str(tmp_path / 'b.txt'), 'optional': True}])
+
+    assert set(desired) == {'30.0.0.0/24'}
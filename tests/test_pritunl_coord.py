@@ -0,0 +1,146 @@
+"""
+Тесты очереди изменений pritunl_coord.py: устаревшие записи и выведенные серверы.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pritunl_coord
+
+OLD_ID = 'a' * 24
+NEW_ID = 'b' * 24
+
+
+@pytest.fixture(autouse=True)
+def coord_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pritunl_coord, 'COORD_DIR', str(tmp_path))
+    return tmp_path
+
+
+def queue_raw(server_id, mutation):
+    with open(pritunl_coord._path('queue', f'server_{server_id}.jsonl'), 'a') as file:
+        file.write(json.dumps(mutation) + '\n')
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_drain_keeps_live_entries():
+    pritunl_coord.enqueue_mutation(OLD_ID, {'job': 'live', 'add': ['10.0.0.0/24']})
+
+    mutations = pritunl_coord.drain_mutations(OLD_ID)
+
+    assert [mutation['job'] for mutation in mutations] == ['live']
+    assert mutations[0]['pid'] == os.getpid()
+    assert pritunl_coord.drain_mutations(OLD_ID) == []
+
+
+def test_drain_drops_entries_of_dead_or_old_jobs():
+    queue_raw(OLD_ID, {'job': 'dead', 'pid': dead_pid(), 'queued_at': time.time(), 'add': ['10.0.1.0/24']})
+    queue_raw(OLD_ID, {'job': 'old', 'pid': os.getpid(), 'queued_at': time.time() - pritunl_coord.MUTATION_TTL - 1})
+    queue_raw(OLD_ID, {'job': 'owner-less', 'add': ['10.0.2.0/24']})
+    pritunl_coord.enqueue_mutation(OLD_ID, {'job': 'live'})
+
+    assert [mutation['job'] for mutation in pritunl_coord.drain_mutations(OLD_ID)] == ['live']
+
+
+def test_retired_server_rejects_queue_and_new_changes():
+    pritunl_coord.enqueue_mutation(OLD_ID, {'job': 'queued', 'add': ['10.0.0.0/24']})
+
+    pritunl_coord.retire_server(OLD_ID, NEW_ID)
+
+    assert pritunl_coord.drain_mutations(OLD_ID) == []
+    with pytest.raises(pritunl_coord.ServerRetired):
+        with pritunl_coord.mutation_window(OLD_ID, {'job': 'late', 'add': ['10.0.1.0/24']}):
+            pass
+    assert pritunl_coord.drain_mutations(OLD_ID) == []
+
+
+def test_waiting_job_does_not_get_window_on_retired_server():
+    locked = threading.Event()
+
+    def switch_over():
+        # blue/green держит старый сервер, пока задание ждет, и переключает его на новый
+        with pritunl_coord.server_lock(OLD_ID):
+            locked.set()
+            time.sleep(0.3)
+            pritunl_coord.retire_server(OLD_ID, NEW_ID)
+
+    thread = threading.Thread(target=switch_over)
+    thread.start()
+    locked.wait()
+    try:
+        with pytest.raises(pritunl_coord.ServerRetired):
+            with pritunl_coord.mutation_window(OLD_ID, {'job': 'waiting', 'add': ['10.0.0.0/24']}):
+                pass
+    finally:
+        thread.join()
+    assert pritunl_coord.drain_mutations(OLD_ID) == []
+
+
+def test_rollback_unretires_previous_server():
+    pritunl_coord.retire_server(OLD_ID, NEW_ID)
+    pritunl_coord.retire_server(NEW_ID, OLD_ID)
+
+    assert pritunl_coord.retired_to(OLD_ID) is None
+    assert pritunl_coord.retired_to(NEW_ID) == OLD_ID
+    with pritunl_coord.mutation_window(OLD_ID, {'job': 'after-rollback'}) as window:
+        assert window is not None
+
+
+def hold_and_apply(requests_sent, delay):
+    """ Задание, которое держит сервер delay секунд и затем применяет очередь. """
+    locked = threading.Event()
+
+    def request(method, path, data=None):
+        requests_sent.append((method, data and data['network']))
+        return {}
+
+    def holder():
+        with pritunl_coord.server_lock(OLD_ID):
+            locked.set()
+            time.sleep(delay)
+            pritunl_coord.MutationWindow(OLD_ID).apply(request)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    locked.wait()
+    return thread, request
+
+
+def test_waiting_job_gets_none_when_its_change_was_applied(coord_dir):
+    requests_sent = []
+    thread, _ = hold_and_apply(requests_sent, 0.3)
+    try:
+        with pritunl_coord.mutation_window(OLD_ID, {'job': 'waiting', 'add': ['10.0.0.0/24']}) as window:
+            assert window is None
+    finally:
+        thread.join()
+
+    assert requests_sent == [('POST', '10.0.0.0/24')]
+    assert os.listdir(coord_dir / 'done') == []
+
+
+def test_waiting_job_applies_its_change_dropped_as_stale(monkeypatch):
+    monkeypatch.setattr(pritunl_coord, 'MUTATION_TTL', 0.2)
+    requests_sent = []
+    thread, request = hold_and_apply(requests_sent, 0.5)
+    try:
+        with pritunl_coord.mutation_window(OLD_ID, {'job': 'waiting', 'add': ['10.0.0.0/24']}) as window:
+            assert window is not None
+            added, _ = window.apply(request)
+    finally:
+        thread.join()
+
+    assert added == {'10.0.0.0/24'}
+    assert requests_sent == [('POST', '10.0.0.0/24')]
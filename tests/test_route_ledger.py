@@ -0,0 +1,121 @@
+"""
+Тесты журнала маршрутов add-routeAZ_to_del.py: сравнение с сервером, устаревание и обновление журнала.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_spec = importlib.util.spec_from_file_location('add_route_az_to_del', os.path.join(ROOT, 'add-routeAZ_to_del.py'))
+az = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(az)
+
+SERVER_ID = 'a' * 24
+SOURCE = {'provider': 'plain', 'tag': 'a.txt', 'change_number': None, 'file': 'a.txt'}
+
+
+def ledger_entry(file='a.txt'):
+    return {'source': {'file': file}, 'first_seen': '2025-01-01T00:00:00+00:00',
+            'last_seen': '2025-01-01T00:00:00+00:00'}
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(az, 'LEDGER_DIR', str(tmp_path / 'routes_ledger'))
+    return tmp_path
+
+
+@pytest.fixture
+def server_routes(monkeypatch):
+    routes = {}
+    monkeypatch.setattr(az, 'get_existing_routes', lambda *args: None if routes is None else dict(routes))
+    return routes
+
+
+def plan(azure_ips, legacy_routes=()):
+    return az.plan_azure_routes('http://stub', 't', 's', SERVER_ID, azure_ips, set(legacy_routes))
+
+
+def test_plan_adds_missing_and_expires_only_ledger_routes(server_routes):
+    server_routes.update({'10.0.0.0/24': 'r1', '10.0.1.0/24': 'r2', '192.168.0.0/24': 'manual'})
+    az.save_ledger(SERVER_ID, {'10.0.0.0/24': ledger_entry(), '10.0.1.0/24': ledger_entry()})
+
+    ledger, existing, routes_to_add, routes_to_expire = plan({'10.0.0.0/24': SOURCE, '10.0.2.0/24': SOURCE})
+
+    assert routes_to_add == ['10.0.2.0/24']
+    assert routes_to_expire == {'10.0.1.0/24': 'r2'}
+    assert '192.168.0.0/24' not in routes_to_expire
+
+
+def test_plan_ignores_ledger_routes_already_gone(server_routes):
+    server_routes.update({'10.0.0.0/24': 'r1'})
+    az.save_ledger(SERVER_ID, {'10.0.0.0/24': ledger_entry(), '10.0.9.0/24': ledger_entry()})
+
+    _, _, routes_to_add, routes_to_expire = plan({'10.0.0.0/24': SOURCE})
+
+    assert routes_to_add == []
+    assert routes_to_expire == {}
+
+
+def test_first_run_adopts_legacy_routes_present_on_server(server_routes):
+    server_routes.update({'10.0.0.0/24': 'r1', '10.0.1.0/24': 'r2'})
+
+    ledger, _, _, routes_to_expire = plan({'10.0.0.0/24': SOURCE}, legacy_routes={'10.0.1.0/24', '10.0.5.0/24'})
+
+    assert set(ledger) == {'10.0.1.0/24'}
+    assert routes_to_expire == {'10.0.1.0/24': 'r2'}
+
+
+def test_plan_returns_none_when_listing_fails(monkeypatch):
+    monkeypatch.setattr(az, 'get_existing_routes', lambda *args: None)
+
+    assert plan({'10.0.0.0/24': SOURCE}) is None
+
+
+def test_update_ledger_records_changes():
+    ledger = {
+        '10.0.0.0/24': ledger_entry(),   # остается в источнике
+        '10.0.1.0/24': ledger_entry(),   # удален как устаревший
+        '10.0.2.0/24': ledger_entry(),   # устарел, но удалить не удалось
+        '10.0.3.0/24': ledger_entry(),   # удален с сервера вручную
+    }
+    existing = {'10.0.0.0/24': 'r0', '10.0.1.0/24': 'r1', '10.0.2.0/24': 'r2'}
+    azure_ips = {'10.0.0.0/24': SOURCE, '10.0.4.0/24': SOURCE, '10.0.5.0/24': SOURCE}
+
+    ledger = az.update_ledger(ledger, azure_ips, existing, added_routes={'10.0.4.0/24'},
+                              deleted_routes={'10.0.1.0/24'})
+
+    assert set(ledger) == {'10.0.0.0/24', '10.0.2.0/24', '10.0.4.0/24'}
+    assert ledger['10.0.4.0/24']['source'] == SOURCE
+    assert ledger['10.0.4.0/24']['source'] is not SOURCE
+    assert ledger['10.0.0.0/24']['last_seen'] != '2025-01-01T00:00:00+00:00'
+    assert ledger['10.0.2.0/24']['last_seen'] == '2025-01-01T00:00:00+00:00'
+
+
+def test_manage_server_skips_server_when_listing_fails(monkeypatch):
+    requests_sent = []
+    monkeypatch.setattr(az, 'get_existing_routes', lambda *args: None)
+    monkeypatch.setattr(az, 'send_request', lambda url, method, *args, **kwargs: requests_sent.append((method, url)))
+    az.save_ledger(SERVER_ID, {'10.0.0.0/24': ledger_entry()})
+
+    result = az.manage_server('http://stub', 't', 's', SERVER_ID, 'test', {'10.0.1.0/24': SOURCE}, set())
+
+    assert result == (az.SKIPPED, 'route listing failed')
+    assert requests_sent == []
+    assert set(az.load_ledger(SERVER_ID)) == {'10.0.0.0/24'}
+
+
+def test_empty_managed_set_truncates_routes_to_delete():
+    az.save_routes_to_delete({'10.0.0.0/24', '10.0.1.0/24'})
+    assert az.load_routes_to_delete() == {'10.0.0.0/24', '10.0.1.0/24'}
+
+    az.save_routes_to_delete(set())
+
+    assert az.load_routes_to_delete() == set()
+    with open(az.ROUTES_DELETE_FILE) as file:
+        assert file.read() == ''
@@ -0,0 +1,71 @@
+"""
+Тесты потокового чтения маршрутов route_stream.py.
+"""
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import route_stream
+
+
+def fake_response(body, status=200):
+    response = requests.models.Response()
+    response.status_code = status
+    response._content = body.encode('utf-8')
+    response._content_consumed = True
+    response.url = 'http://stub/server/1/route'
+    return response
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def install(body, status=200):
+        monkeypatch.setattr(requests, 'request', lambda *args, **kwargs: fake_response(body, status))
+    return install
+
+
+def test_iter_json_array_across_chunks():
+    chunks = ['[{"id": "1", "netw', 'ork": "10.0.0.0/24"}, {"id"', ': "2", "network": "10.0.1.0/24"}]']
+
+    assert [item['id'] for item in route_stream.iter_json_array(chunks)] == ['1', '2']
+
+
+def test_fetch_keeps_only_requested_fields(serve):
+    serve('[{"id": "1", "network": "10.0.0.0/24", "comment": "x"}]')
+
+    routes = route_stream.fetch_routes_stream('http://stub/server/1/route', {})
+
+    assert list(routes) == [{'id': '1', 'network': '10.0.0.0/24'}]
+
+
+def test_fetch_returns_none_on_http_error(serve):
+    serve('{"error": "not found"}', status=404)
+
+    assert route_stream.fetch_routes_stream('http://stub/server/1/route', {}) is None
+
+
+@pytest.mark.parametrize('body', ['<html>bad gateway</html>', '[{"id": "1", "network": "10.0.0.0/24"}, {"id"'])
+def test_broken_body_raises_route_stream_error(serve, body):
+    serve(body)
+
+    with pytest.raises(route_stream.RouteStreamError):
+        list(route_stream.fetch_routes_stream('http://stub/server/1/route', {}))
+
+
+def test_broken_stream_keeps_previous_snapshot(serve, tmp_path):
+    filename = str(tmp_path / 'server_1_routes.yml')
+    serve('[{"id": "1", "network": "10.0.0.0/24"}]')
+    assert route_stream.write_routes_yaml('1', route_stream.fetch_routes_stream('http://stub', {}), filename) == 1
+    with open(filename) as file:
+        snapshot = file.read()
+
+    serve('[{"id": "2", "network": "10.0.1.0/24"}, {"id"')
+    assert route_stream.write_routes_yaml('1', route_stream.fetch_routes_stream('http://stub', {}), filename) is None
+
+    with open(filename) as file:
+        assert file.read() == snapshot
+    assert os.listdir(tmp_path) == ['server_1_routes.yml']
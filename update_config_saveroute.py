@@ -1,5 +1,4 @@
 import requests
-import json
 import hmac
 import hashlib
 import base64
@@ -7,22 +6,28 @@ import time
 import uuid
 import yaml
 import os
+from pritunl_profile import profile_main, traced
+from pritunl_cassette import install_cassette
+from route_stream import fetch_routes_stream, write_routes_yaml
+from pritunl_coord import atomic_write, settings_lock
 
 SETTINGS_FILE = 'pritunl_settings.yml'
 BACKUP_DIR = 'routes_backup'
 
+@traced()
 def load_settings(filename=SETTINGS_FILE):
     """ Загружает конфигурацию из YAML-файла. """
     with open(filename, 'r') as file:
         return yaml.safe_load(file)
 
+@traced()
 def save_settings(settings, filename=SETTINGS_FILE):
     """ Сохраняет обновленные настройки в YAML-файл. """
-    with open(filename, 'w') as file:
-        yaml.dump(settings, file, default_flow_style=False, allow_unicode=True)
+    atomic_write(filename, lambda file: yaml.dump(settings, file, default_flow_style=False, allow_unicode=True))
 
     print(f"Settings updated in {filename}")
 
+@traced('sign', args=('method', 'path'))
 def create_signature(api_token, api_secret, method, path):
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
@@ -35,6 +40,7 @@ def create_signature(api_token, api_secret, method, path):
         'Auth-Signature': base64.b64encode(signature).decode()
     }
 
+@traced('http', args=('method', 'url'))
 def send_request(url, method, headers, data=None):
     try:
         if data:
@@ -51,46 +57,55 @@ def send_request(url, method, headers, data=None):
         print(f"Request failed: {e}")
         return None
 
+@traced(args=('server_id',))
 def get_server_routes(base_url, api_token, api_secret, server_id):
-   
+    """ Потоково получает маршруты: пишет снимок в BACKUP_DIR и обновляет подсети в настройках. """
     url = f'{base_url}/server/{server_id}/route'
     headers = create_signature(api_token, api_secret, 'GET', f'/server/{server_id}/route')
-    
-    routes = send_request(url, 'GET', headers)
-    if routes is not None:
-        print(f'Routes for server {server_id}: {json.dumps(routes, indent=2)}')
-        save_routes_to_yaml(server_id, routes)
-        update_main_settings(server_id, routes)
-    return routes
 
-def save_routes_to_yaml(server_id, routes):
-    """ Сохраняет список маршрутов в отдельный YAML-файл. """
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+    routes = fetch_routes_stream(url, headers, verify=True, timeout=30)
+    if routes is None:
+        return None
 
-    filename = os.path.join(BACKUP_DIR, f'server_{server_id}_routes.yml')
-    with open(filename, 'w') as file:
-        yaml.dump({'server_id': server_id, 'routes': routes}, file, default_flow_style=False, allow_unicode=True)
+    networks = []
+    if save_routes_to_yaml(server_id, collect_networks(routes, networks)) is None:
+        # Неполный список не должен попасть в настройки
+        return None
+    update_main_settings(server_id, networks)
+    return networks
 
-    print(f"Routes saved to {filename}")
+def collect_networks(routes, networks):
+    for route in routes:
+        networks.append(route['network'])
+        yield route
 
-def update_main_settings(server_id, routes):
-    
-    settings = load_settings()
+@traced(args=('server_id',))
+def save_routes_to_yaml(server_id, routes):
+    """ Сохраняет маршруты в отдельный YAML-файл по мере получения. """
+    filename = os.path.join(BACKUP_DIR, f'server_{server_id}_routes.yml')
+    count = write_routes_yaml(server_id, routes, filename)
+    if count is not None:
+        print(f"{count} routes saved to {filename}")
+    return count
+
+@traced(args=('server_id',))
+def update_main_settings(server_id, networks):
+    """ Обновляет маршруты сервера в настройках; файл читается заново под блокировкой. """
+    with settings_lock():
+        settings = load_settings()
+
+        for item in settings.get('routes', []):
+            if item['server_id'] == server_id:
+                item['network'] = networks
+                break
+        else:
+           
+            settings.setdefault('routes', []).append({
+                'server_id': server_id,
+                'network': networks
+            })
 
-   
-    for item in settings.get('routes', []):
-        if item['server_id'] == server_id:
-            item['network'] = [route['network'] for route in routes]
-            break
-    else:
-       
-        settings.setdefault('routes', []).append({
-            'server_id': server_id,
-            'network': [route['network'] for route in routes]
-        })
-
-    save_settings(settings)
+        save_settings(settings)
 
 def main():
     settings = load_settings()
@@ -104,4 +119,5 @@ def main():
         get_server_routes(base_url, api_token, api_secret, server_id)
 
 if __name__ == '__main__':
-    main()
+    install_cassette()
+    profile_main(main)